@@ -0,0 +1,39 @@
+import logging
+import argparse
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res/'))
+from export import FORMATS, ROWS, export_projects  # noqa: E402
+
+
+def main(argv=None):
+    """
+    Exports the graphs and annotations of each given project directory to pdf and png without opening a window,
+    projects are exported in parallel, returns 1 if any project failed
+    """
+    parser = argparse.ArgumentParser(description='Export BrainWave projects to pdf and png without a display.')
+    parser.add_argument('projects', nargs='+', help='project directories holding a .cal and .wav files')
+    parser.add_argument('-o', '--output', help='directory to write to, the project directory by default')
+    parser.add_argument('-f', '--format', action='append', choices=FORMATS, dest='formats',
+                        help='format to export, can be repeated, both by default')
+    parser.add_argument('-p', '--pages', type=float, metavar='SECONDS',
+                        help='also export the whole recording as strips of SECONDS each to <project>_pages.pdf')
+    parser.add_argument('-r', '--rows', type=int, default=ROWS, help='strips per page of --pages, {} by default'.format(ROWS))
+    parser.add_argument('-w', '--workers', type=int, help='number of projects exported at once, one per cpu by default')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+    failed = 0
+    results = export_projects(args.projects, args.output, args.formats or FORMATS, args.workers, args.pages, args.rows)
+    for path, files, error in results:
+        if error is None:
+            print('{}: {}'.format(path, ', '.join(files)))
+        else:
+            failed += 1
+            print('{}: failed, {}'.format(path, error), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
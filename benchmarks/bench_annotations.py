@@ -0,0 +1,62 @@
+import sys
+import os
+from os.path import dirname
+sys.path.append(os.path.join(dirname(dirname(os.path.abspath(__file__))), 'res/'))
+import json  # noqa: E402
+import tempfile  # noqa: E402
+import timeit  # noqa: E402
+import datetime as dt  # noqa: E402
+from annotations import Annotation, open_json, save_json  # noqa: E402
+
+
+def decode_annotation_strptime(dict):
+    """
+        The original decoder hook, parsing both times with strptime
+    """
+    if "__annotation__" in dict:
+        return Annotation(dict["title"], dict["content"], dt.datetime.strptime(
+            dict["start_time"], "%Y-%m-%dT%H:%M:%S.%f"), dt.datetime.strptime(dict["end_time"], "%Y-%m-%dT%H:%M:%S.%f"), dict["color"])
+    return dict
+
+
+def open_json_strptime(filename):
+    with open(filename) as infile:
+        return json.load(infile, object_hook=decode_annotation_strptime)
+
+
+def generate(count):
+    """
+        Returns count machine-generated annotations, one every few seconds, every tenth a point annotation
+    """
+    start = dt.datetime(2008, 2, 4, 16, 24, 43, 500)
+    annotations = []
+    for i in range(count):
+        begin = start + dt.timedelta(seconds=3 * i, microseconds=i % 1000)
+        end = begin if i % 10 == 0 else begin + dt.timedelta(seconds=2)
+        annotations.append(Annotation("Event {}".format(i), "Detected automatically.\n", begin, end, (0, 128, 256)))
+    return annotations
+
+
+def main(count=100000, repeat=3):
+    """
+        Times loading count annotations with open_json against the strptime decoder and prints the speedup
+    """
+    count = int(count)
+    handle, filename = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    try:
+        save_json(generate(count), filename)
+        if open_json(filename) != open_json_strptime(filename):
+            raise Exception("Decoders disagree")
+        old = min(timeit.repeat(lambda: open_json_strptime(filename), number=1, repeat=repeat))
+        new = min(timeit.repeat(lambda: open_json(filename), number=1, repeat=repeat))
+    finally:
+        os.remove(filename)
+    print("annotations:      {}".format(count))
+    print("strptime decode:  {:.3f} s".format(old))
+    print("open_json:        {:.3f} s".format(new))
+    print("speedup:          {:.1f}x".format(old / new))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,54 @@
+import sys
+import os
+from os.path import dirname
+sys.path.append(os.path.join(dirname(dirname(os.path.abspath(__file__))), 'res/'))
+import glob  # noqa: E402
+import struct  # noqa: E402
+import timeit  # noqa: E402
+import numpy as np  # noqa: E402
+from data import read_wav  # noqa: E402
+
+
+def read_wav_per_sample(filename):
+    """
+        The original decoder, reading two bytes and calling struct.unpack for every ICB reading
+    """
+    frames = []
+    with open(filename, 'rb') as infile:
+        raw_data = infile.read(2)
+        data = struct.unpack('h', raw_data)[0]
+        while raw_data != b"":
+            frames.append(data)
+            raw_data = infile.read(2)
+            if len(raw_data) == 2:
+                data = struct.unpack('h', raw_data)[0]
+    return np.array(frames)
+
+
+def main(path="./data/recording2/pat2/", repeat=3):
+    """
+        Times both decoders over every .wav segment of the project at path and prints the speedup
+    """
+    datafiles = sorted(glob.glob(os.path.join(path, "*.wav")))
+    for file in datafiles:
+        if not np.array_equal(read_wav(file), read_wav_per_sample(file)):
+            raise Exception("Decoders disagree on {}".format(file))
+
+    def per_sample():
+        for file in datafiles:
+            read_wav_per_sample(file)
+
+    def bulk():
+        for file in datafiles:
+            read_wav(file)
+
+    old = min(timeit.repeat(per_sample, number=1, repeat=repeat))
+    new = min(timeit.repeat(bulk, number=1, repeat=repeat))
+    print("segments: {}".format(len(datafiles)))
+    print("per-sample decode: {:.3f} s".format(old))
+    print("bulk decode:       {:.4f} s".format(new))
+    print("speedup:           {:.0f}x".format(old / new))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,187 @@
+import sys
+import os
+from os.path import dirname
+ROOT = dirname(dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'res/'))
+sys.path.append(os.path.join(ROOT, 'benchmarks/'))
+import argparse  # noqa: E402
+import glob  # noqa: E402
+import json  # noqa: E402
+import platform  # noqa: E402
+import shutil  # noqa: E402
+import subprocess  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+import tracemalloc  # noqa: E402
+import multiprocessing  # noqa: E402
+import matplotlib  # noqa: E402
+import numpy as np  # noqa: E402
+import data  # noqa: E402
+import export  # noqa: E402
+from annotations import open_json, save_json  # noqa: E402
+from cache import DecodeCache  # noqa: E402
+from synthetic import generate_project  # noqa: E402
+
+HOURS = (1, 6, 24, 48)
+
+
+def open_project_cold(path):
+    """
+        opens the project with no decode cache and builds its pyramid, as the first open of a recording does
+    """
+    calfile, datafiles, jsonfile = data.scan_project(path)
+    # the sidecar is wherever DecodeCache keeps it, next to the project or in BRAINWAVE_CACHE_DIR
+    cache = DecodeCache(path, datafiles + ([calfile] if calfile != "" else []))
+    if os.path.exists(cache.path):
+        os.remove(cache.path)
+    recording, timestamps, annotations = data.open_project(path)
+    recording.pyramid
+
+
+def open_project_warm(path):
+    """
+        opens the project again, restoring the timebase and pyramid from the decode cache
+    """
+    recording, timestamps, annotations = data.open_project(path)
+    recording.pyramid
+
+
+def read_wav(path):
+    for filename in glob.glob(os.path.join(path, '*.wav')):
+        data.read_wav(filename)
+
+
+def open_annotations(path):
+    open_json(os.path.join(path, 'annotations.json'))
+
+
+def save_annotations(path, annotations):
+    save_json(annotations, os.path.join(path, 'saved.json'))
+
+
+def draw_graph(recording, annotations):
+    """
+        draws the main and reference graphs with annotations on Agg, as the application does after opening
+    """
+    for figure in export.project_figures(recording, annotations):
+        figure.canvas.draw()
+
+
+BENCHMARKS = {
+    'open_project_cold': (open_project_cold, None),
+    'open_project_warm': (open_project_warm, None),
+    'read_wav': (read_wav, None),
+    'open_json': (open_annotations, None),
+    'save_json': (save_annotations, 'annotations'),
+    'draw_graph': (draw_graph, 'project'),
+}
+
+
+def measure(name, path):
+    """
+        runs one benchmark on the project at path, in a process of its own so peak memory is its own,
+        returns the wall time in seconds, the peak of memory allocated while it ran and the peak resident size
+    """
+    function, setup = BENCHMARKS[name]
+    if setup == 'annotations':
+        args = (open_json(os.path.join(path, 'annotations.json')),)
+    elif setup == 'project':
+        args = export.open_for_export(path)
+    else:
+        args = ()
+    args = (path,) + args if setup != 'project' else args
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    try:
+        import resource
+        # kilobytes on linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        rss = None
+    return {'seconds': seconds, 'peak_allocated_bytes': peak, 'peak_rss_bytes': rss}
+
+
+def environment():
+    """
+        returns what the results depend on besides the code, and the commit of the code when in a git checkout
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def run(hours=HOURS, names=tuple(BENCHMARKS), repeat=3, directory=None):
+    """
+        generates a synthetic project for every length in hours and runs every benchmark on it repeat times,
+        each run in a fresh process, returns the results with the fastest run of each benchmark
+    """
+    results = []
+    keep = directory is not None
+    directory = directory or tempfile.mkdtemp()
+    context = multiprocessing.get_context('spawn')
+    try:
+        for length in hours:
+            path = os.path.join(directory, '{}h'.format(length), '')
+            if not os.path.exists(path):
+                readings = generate_project(path, length)
+            else:
+                readings = len(data.open_project(path)[0])
+            for name in names:
+                runs = []
+                for i in range(repeat):
+                    with context.Pool(1) as pool:
+                        runs.append(pool.apply(measure, (name, path)))
+                best = min(runs, key=lambda run: run['seconds'])
+                result = dict(benchmark=name, hours=length, readings=readings, runs=len(runs), **best)
+                print('{benchmark:>18} {hours:>4}h {seconds:9.3f} s {peak_allocated_bytes:>14,} B'.format(**result))
+                results.append(result)
+    finally:
+        if not keep:
+            shutil.rmtree(directory)
+    return results
+
+
+def compare(old, new):
+    """
+        prints the time and memory of every benchmark in the results file new relative to old
+    """
+    with open(old) as infile:
+        before = {(r['benchmark'], r['hours']): r for r in json.load(infile)['results']}
+    with open(new) as infile:
+        after = json.load(infile)['results']
+    for result in after:
+        previous = before.get((result['benchmark'], result['hours']))
+        if previous is None:
+            continue
+        print('{:>18} {:>4}h  time {:6.2f}x  memory {:6.2f}x'.format(
+            result['benchmark'], result['hours'], result['seconds'] / max(previous['seconds'], 1e-9),
+            result['peak_allocated_bytes'] / max(previous['peak_allocated_bytes'], 1)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times BrainWave on synthetic recordings of several lengths.')
+    parser.add_argument('--hours', type=float, nargs='+', default=HOURS, help='recording lengths to generate')
+    parser.add_argument('--benchmark', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the fastest is kept')
+    parser.add_argument('--projects', help='directory to generate the projects in and reuse them from')
+    parser.add_argument('--output', default='bench_results.json', help='json file to write the results to')
+    parser.add_argument('--compare', metavar='OLD', help='results file of an earlier commit to compare with')
+    args = parser.parse_args(argv)
+    results = run(args.hours, args.benchmark, args.repeat, args.projects)
+    with open(args.output, 'w') as outfile:
+        json.dump({'environment': environment(), 'results': results}, outfile, indent=1)
+    print('Results written to {}'.format(args.output))
+    if args.compare:
+        compare(args.compare, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import sys
+import os
+from os.path import dirname
+sys.path.append(os.path.join(dirname(dirname(os.path.abspath(__file__))), 'res/'))
+import datetime  # noqa: E402
+import numpy as np  # noqa: E402
+from annotations import Annotation, save_json  # noqa: E402
+
+# readings per second, per .wav segment and between .cal checkpoints of the real recordings
+RATE = 50
+SEGMENT = 500000
+CHECKPOINT = 16950
+START = datetime.datetime(2008, 4, 2, 16, 24, 49)
+
+
+def generate_project(path, hours, annotations_per_hour=60, seed=0):
+    """
+        Writes a synthetic project of the given length to path in the layout of the real recordings,
+        a .cal file with a checkpoint every CHECKPOINT readings, numbered .wav segments of SEGMENT readings
+        and an annotations.json, returns the number of readings
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    length = int(hours * 3600 * RATE)
+    prefix = START.strftime('%m-%d-%Y_%H_%M_%S')
+    for segment, first in enumerate(range(0, length, SEGMENT)):
+        count = min(SEGMENT, length - first)
+        # a slow drift with noise and the odd spike, in tenths of the calibrated unit
+        drift = 100 * np.sin(2 * np.pi * (first + np.arange(count)) / (RATE * 3600))
+        readings = drift + np.cumsum(rng.normal(0, 3, count)) / 20 + rng.normal(0, 20, count)
+        spikes = rng.randint(0, count, size=max(count // 20000, 1))
+        readings[spikes] += 600
+        name = '{}_{}_000000.wav'.format(prefix, '0000' if segment == 0 else segment)
+        np.clip(readings, -32768, 32767).astype('<i2').tofile(os.path.join(path, name))
+    with open(os.path.join(path, '{}_0000_000000.cal'.format(prefix)), 'w') as outfile:
+        outfile.write(START.strftime('%d-%m-%Y %H:%M:%S') + ' --> Data Collection Started\n')
+        # the device clock runs a little fast or slow, and checkpoints are logged to the second
+        skew = 1 + rng.normal(0, 0.002)
+        for checkpoint in range(CHECKPOINT, length, CHECKPOINT):
+            time = START + datetime.timedelta(seconds=checkpoint / RATE * skew + rng.uniform(-0.5, 0.5))
+            outfile.write(time.strftime('%d-%m-%Y\t%H:%M:%S') + '\n')
+    save_json(generate_annotations(hours, annotations_per_hour, rng), os.path.join(path, 'annotations.json'))
+    return length
+
+
+def generate_annotations(hours, per_hour, rng):
+    """
+        Returns annotations spread over the given hours, every tenth a point annotation
+    """
+    annotations = []
+    for i in range(int(hours * per_hour)):
+        start = START + datetime.timedelta(seconds=float(rng.uniform(0, hours * 3600 - 120)))
+        end = start if i % 10 == 0 else start + datetime.timedelta(seconds=float(rng.uniform(1, 120)))
+        annotations.append(Annotation('Event {}'.format(i), 'Generated.\n', start, end, (0, 128, 256)))
+    return annotations
+
+
+if __name__ == '__main__':
+    print(generate_project(sys.argv[1], float(sys.argv[2])), 'readings')
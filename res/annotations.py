@@ -1,7 +1,20 @@
 import json
 import datetime as dt
+import os
+import tempfile
+import threading
+import contextlib
+import queue
+import numpy as np
 import itertools
+import bisect
 import logging
+import instrument
+try:
+    import fcntl
+except ImportError:
+    # no locking between processes on windows, windows in one process are still kept apart
+    fcntl = None
 
 
 class AnnotationException(Exception):
@@ -12,11 +25,20 @@ class AnnotationException(Exception):
     pass
 
 
+# version of the timebase annotation times are on, saved with each annotation. Annotations without one were saved
+# on the uniform start + i * 20 ms timebase of earlier builds, before the .cal checkpoints were used
+TIMEBASE = 2
+
+
 class Annotation:
     """
     Basic annotation class to represent annotations within the application, implements eq, str and repr for debugging purposes.
+    Uses slots as projects can hold hundreds of thousands of annotations.
     """
+    __slots__ = ('title', 'content', 'start', 'end', 'id', 'color')
     id_generator = itertools.count(1)
+    # color of annotations saved without one, red
+    DEFAULT_COLOR = (256, 0, 0)
 
     def __init__(self, title, content, start_time, end_time, color):
         self.title = title
@@ -27,7 +49,7 @@ class Annotation:
         self.color = color
 
     def __str__(self):
-        return str(vars(self))
+        return str({name: getattr(self, name) for name in self.__slots__})
 
     def __repr__(self):
         return str(self)
@@ -39,7 +61,85 @@ class Annotation:
         return self.title == other.title and self.content == other.content and self.start == other.start and self.end == other.end
 
     def __hash__(self):
-        return hash((self.title, self.content, self.start, self.end))
+        return hash(annotation_key(self))
+
+
+def annotation_key(annotation):
+    """
+    returns the fields Annotation.__eq__ compares, as a key that stays the same when the annotation is edited later
+    """
+    return (annotation.title, annotation.content, annotation.start, annotation.end)
+
+
+class AnnotationStore:
+    """
+    Holds the annotations of a project in listbox order, with O(1) lookup by id and by listbox position
+    and a sorted interval index answering which annotations overlap a time window.
+    """
+
+    def __init__(self, annotations=()):
+        self.by_id = {}
+        self.order = []
+        # whether sorted, starts, ends and max_ends reflect the current annotations
+        self.indexed = False
+        for annotation in annotations:
+            self.add(annotation)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return (self.by_id[id] for id in self.order)
+
+    def get(self, id):
+        return self.by_id[id]
+
+    def at(self, index):
+        """
+        returns the annotation at a listbox position
+        """
+        return self.by_id[self.order[index]]
+
+    def add(self, annotation):
+        """
+        appends an annotation at the end of the listbox order
+        """
+        self.by_id[annotation.id] = annotation
+        self.order.append(annotation.id)
+        self.indexed = False
+
+    def remove(self, index):
+        """
+        removes and returns the annotation at a listbox position
+        """
+        annotation = self.by_id.pop(self.order.pop(index))
+        self.indexed = False
+        return annotation
+
+    def build_index(self):
+        """
+        sorts the annotations by start and keeps the running maximum of their ends,
+        rebuilt lazily on the first query after a change
+        """
+        annotations = sorted(self.by_id.values(), key=lambda a: a.start)
+        self.sorted = annotations
+        self.starts = np.array([a.start for a in annotations], dtype='datetime64[us]')
+        self.ends = np.array([a.end for a in annotations], dtype='datetime64[us]')
+        self.max_ends = np.maximum.accumulate(self.ends) if annotations else self.ends
+        self.indexed = True
+
+    def overlapping(self, start, end):
+        """
+        returns the annotations overlapping [start, end], ordered by start
+        """
+        if not self.indexed:
+            self.build_index()
+        start, end = np.datetime64(start, 'us'), np.datetime64(end, 'us')
+        # nothing before first can reach start, nothing from last on starts before end
+        first = np.searchsorted(self.max_ends, start, side='left')
+        last = np.searchsorted(self.starts, end, side='right')
+        hits = np.flatnonzero(self.ends[first:last] >= start) + first
+        return [self.sorted[i] for i in hits]
 
 
 def encode_annotation(annotation):
@@ -48,43 +148,404 @@ def encode_annotation(annotation):
     """
     if isinstance(annotation, Annotation):
         return {"__annotation__": True, "title": annotation.title, "content": annotation.content,
-                "start_time": dt.datetime.isoformat(annotation.start), "end_time": dt.datetime.isoformat(annotation.end), "color": annotation.color}
+                "start_time": dt.datetime.isoformat(annotation.start), "end_time": dt.datetime.isoformat(annotation.end), "color": annotation.color,
+                "timebase": TIMEBASE}
     else:
         type_name = annotation.__class__.__name__
         raise TypeError(
             "Object of type '{}' is not JSON serializable".format(type_name))
 
 
-def decode_annotation(dict):
+def decode_annotation(dict, convert=None):
     """
-    Hook function to help decode an annotation object from a json file
+    Hook function to help decode an annotation object from a json file, times are read with fromisoformat
+    which takes the isoformat output with or without microseconds. The times of annotations saved on an older
+    timebase are passed through convert when given
     """
     if "__annotation__" in dict:
-        return Annotation(dict["title"], dict["content"], dt.datetime.strptime(
-            dict["start_time"], "%Y-%m-%dT%H:%M:%S.%f"), dt.datetime.strptime(dict["end_time"], "%Y-%m-%dT%H:%M:%S.%f"), dict["color"])
+        start, end = dt.datetime.fromisoformat(dict["start_time"]), dt.datetime.fromisoformat(dict["end_time"])
+        if convert is not None and dict.get("timebase", 1) < TIMEBASE:
+            start, end = convert(start), convert(end)
+        return Annotation(dict["title"], dict["content"], start, end, dict.get("color", Annotation.DEFAULT_COLOR))
     return dict
 
 
+def decode_annotations(values, convert=None):
+    """
+    Decodes a list of encoded annotations at once, the fast path of open_json for large files
+    """
+    fromisoformat = dt.datetime.fromisoformat
+    default_color = Annotation.DEFAULT_COLOR
+    annotations = [Annotation(value["title"], value["content"], fromisoformat(value["start_time"]),
+                              fromisoformat(value["end_time"]), value.get("color", default_color)) for value in values]
+    if convert is not None:
+        for annotation, value in zip(annotations, values):
+            if value.get("timebase", 1) < TIMEBASE:
+                annotation.start, annotation.end = convert(annotation.start), convert(annotation.end)
+    return annotations
+
+
 def save_json(annotations, filename):
     """
-    Saves an a list of annotations as a json, takes the list and filename as arguments and saves it as filename in the project directory.
+    Saves an a list of annotations, or an AnnotationStore, as a json, takes the list and filename as arguments and saves it as filename in the project directory.
     """
     logging.info('Encoding annotations as json into {}'.format(filename))
-    with open(filename, "w+") as outfile:
-        json.dump(annotations, outfile, sort_keys=True,
+    with instrument.span('save_json', annotations=len(annotations)) as span, open(filename, "w+") as outfile:
+        json.dump(list(annotations), outfile, sort_keys=True,
                   default=encode_annotation)
+        span.count(outfile.tell())
 
 
-def open_json(filename):
+def open_json(filename, convert=None):
     """
-    Given a filename unpacks a json object into an annotation list
+    Given a filename unpacks a json object into an annotation list, the times of annotations saved on an
+    older timebase are passed through convert when given
     """
     logging.info('Opening json file {}'.format(filename))
     with open(filename) as infile:
         try:
             logging.info('Decoding .json into annotations'.format(filename))
-            return json.load(infile, object_hook=decode_annotation)
+            text = infile.read()
+            values = json.loads(text)
+            if isinstance(values, list) and all(isinstance(value, dict) and "__annotation__" in value for value in values):
+                return decode_annotations(values, convert)
+            return json.loads(text, object_hook=lambda value: decode_annotation(value, convert))
         except Exception:
             logging.error('Wrong annotation format in .json file')
             raise AnnotationException(
                 "Wrong format of annotation in .json file, annotations could not be loaded.")
+
+
+class AnnotationJournal:
+    """
+    Append-only journal of the add, edit and delete operations made on the annotations of a project,
+    so saving an edit costs O(1) instead of rewriting the whole annotations file.
+    The journal starts with the size, mtime and inode of the annotations file it applies to. It is compacted
+    into that file with an atomic rename once it holds as many operations as there are annotations, a journal
+    whose file was replaced since is stale and ignored, so a crash at any point loses at most the last operation.
+    Writers in other windows and processes are kept apart by a lock, and as every operation is replayed
+    from disk they add to each other's annotations instead of overwriting them.
+    Annotations on an older timebase, in the file or the journal, are converted by convert as they are read,
+    so edits match them by their converted times and the next compaction saves them converted.
+    """
+    SUFFIX = '.journal'
+    LOCK_SUFFIX = '.lock'
+    # an annotations file that cannot be read is renamed with this suffix before changes are saved
+    BAD_SUFFIX = '.bad'
+    # fewest operations the journal holds before it is compacted
+    COMPACT_MIN = 256
+    # one lock per journal path for the windows of this process, flock only covers other processes
+    locks = {}
+    locks_lock = threading.Lock()
+
+    def __init__(self, filename, convert=None):
+        self.filename = filename
+        self.convert = convert
+        self.path = os.path.splitext(filename)[0] + self.SUFFIX
+        self.lock_path = os.path.splitext(filename)[0] + self.LOCK_SUFFIX
+        # operations in the journal and annotations after replaying it, counted on first use
+        self.entries = None
+        self.size = None
+
+    def exists(self):
+        return os.path.exists(self.filename) or os.path.exists(self.path)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        holds the lock of this journal against other windows and processes writing the same project
+        """
+        with self.locks_lock:
+            lock = self.locks.setdefault(os.path.abspath(self.path), threading.Lock())
+        with lock, open(self.lock_path, 'a') as lockfile:
+            if fcntl is not None:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+            yield
+
+    def base(self):
+        """
+        returns the size, mtime and inode of the annotations file, None if there is none
+        """
+        if not os.path.exists(self.filename):
+            return None
+        stat = os.stat(self.filename)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def header(self):
+        """
+        returns the base the journal was started for, or False if it is missing or unreadable
+        """
+        try:
+            with open(self.path) as infile:
+                return json.loads(infile.readline())['base']
+        except Exception:
+            return False
+
+    def records(self):
+        """
+        returns the operations in the journal, an empty list if it is missing or stale, skipping torn lines
+        """
+        if self.header() != self.base():
+            if os.path.exists(self.path):
+                logging.info('Annotation journal at {} is stale'.format(self.path))
+            return []
+        with open(self.path) as infile:
+            lines = infile.read().splitlines()
+        records = []
+        for line in lines[1:]:
+            try:
+                records.append(json.loads(line, object_hook=lambda value: decode_annotation(value, self.convert)))
+            except Exception:
+                logging.warning('Skipping unreadable line in annotation journal at {}'.format(self.path))
+        return records
+
+    def load(self):
+        """
+        returns the annotations in the annotations file with the journal replayed over them,
+        the lock is only taken when there is a journal so opening a project does not write to its directory
+        """
+        if not os.path.exists(self.path):
+            return self.replay()
+        with self.locked():
+            return self.replay()
+
+    def replay(self, recover=False):
+        """
+        returns the annotations file with the journal replayed over it. An annotations file that cannot be read
+        raises, or when recover is set is moved aside to BAD_SUFFIX and the journal starts over from no annotations
+        """
+        try:
+            annotations = open_json(self.filename, self.convert) if os.path.exists(self.filename) else []
+        except AnnotationException:
+            if not recover:
+                raise
+            logging.warning('Annotations file at {} could not be read, moved to {}'.format(
+                self.filename, self.filename + self.BAD_SUFFIX))
+            os.replace(self.filename, self.filename + self.BAD_SUFFIX)
+            annotations = []
+        records = self.records()
+        # edits and deletes name the annotation by the fields Annotation.__eq__ compares, so the positions
+        # of the annotations are indexed by those fields once and deleted ones are left as None until the end
+        positions = {}
+        for position, annotation in enumerate(annotations):
+            positions.setdefault(annotation_key(annotation), []).append(position)
+        for record in records:
+            if record['op'] == 'add':
+                positions.setdefault(annotation_key(record['annotation']), []).append(len(annotations))
+                annotations.append(record['annotation'])
+                continue
+            found = positions.get(annotation_key(record['annotation']))
+            if not found:
+                logging.warning('Skipping {} of a missing annotation in journal'.format(record['op']))
+                continue
+            # the first match in list order, as list.index would find
+            index = found.pop(0)
+            if record['op'] == 'delete':
+                annotations[index] = None
+            else:
+                annotations[index].title = record['title']
+                annotations[index].content = record['content']
+                bisect.insort(positions.setdefault(annotation_key(annotations[index]), []), index)
+        annotations = [annotation for annotation in annotations if annotation is not None]
+        self.entries = len(records)
+        self.size = len(annotations)
+        return annotations
+
+    @staticmethod
+    def operation(op, annotation, **fields):
+        """
+        returns an operation as a journal line and the change in the number of annotations it makes,
+        encoded right away so later changes to the annotation are not picked up
+        """
+        record = dict(fields, op=op, annotation=annotation)
+        change = {'add': 1, 'edit': 0, 'delete': -1}[op]
+        return json.dumps(record, sort_keys=True, default=encode_annotation), change
+
+    def add(self, annotation):
+        self.write([self.operation('add', annotation)])
+
+    def edit(self, annotation, title, content):
+        """
+        records an edit of an annotation, called before its title and content are changed
+        """
+        self.write([self.operation('edit', annotation, title=title, content=content)])
+
+    def delete(self, annotation):
+        self.write([self.operation('delete', annotation)])
+
+    def write(self, operations):
+        """
+        appends operations to the journal with a single flush to disk, compacting the journal when it is due
+        """
+        with instrument.span('journal_write', operations=len(operations)) as span, self.locked():
+            if self.entries is None or self.header() != self.base():
+                # an annotations file not read yet or replaced since is read again, and moved aside when broken
+                # so the changes can still be saved
+                self.replay(recover=True)
+            if self.header() != self.base():
+                self.start()
+            with open(self.path, 'rb+') as outfile:
+                # a torn line from a crash is ended so it does not swallow these operations
+                outfile.seek(-1, os.SEEK_END)
+                if outfile.read(1) != b'\n':
+                    outfile.write(b'\n')
+                lines = b''.join(line.encode() + b'\n' for line, change in operations)
+                outfile.write(lines)
+                span.count(len(lines))
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            self.entries += len(operations)
+            self.size += sum(change for line, change in operations)
+            if self.entries >= max(self.COMPACT_MIN, self.size):
+                self.compact()
+
+    def start(self):
+        """
+        replaces the journal with an empty one for the current annotations file
+        """
+        self.replace(self.path, json.dumps({'base': self.base()}) + '\n')
+        self.entries = 0
+
+    def compact(self):
+        """
+        writes the annotations with the journal replayed into the annotations file and starts a new journal,
+        both through an atomic rename, called with the lock held
+        """
+        logging.info('Compacting annotation journal into {}'.format(self.filename))
+        with instrument.span('journal_compact') as span:
+            annotations = self.replay()
+            text = json.dumps(annotations, sort_keys=True, default=encode_annotation)
+            span.count(len(text))
+            self.replace(self.filename, text)
+            self.start()
+
+    @staticmethod
+    def replace(filename, text):
+        """
+        writes text to a temporary file next to filename and renames it over filename
+        """
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as outfile:
+                outfile.write(text)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, filename)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+
+class AnnotationWriter:
+    """
+    Writes the operations of a window to its AnnotationJournal on a background thread, so Tk never waits on the disk.
+    Operations arriving within DELAY seconds of the first are written with one flush. Write errors are put on
+    errors for the window to report and the failed operations are tried again with the next change or flush.
+    """
+    # seconds a burst of changes is collected for before it is written
+    DELAY = 0.5
+    # writers not closed yet, flushed together when the application quits
+    running = set()
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.pending = []
+        # operations queued and written so far, and write attempts, for flush to wait on
+        self.queued = 0
+        self.written = 0
+        self.attempts = 0
+        self.error = None
+        self.flushing = False
+        self.closed = False
+        self.condition = threading.Condition()
+        self.errors = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.running.add(self)
+
+    def add(self, annotation):
+        self.put(self.journal.operation('add', annotation))
+
+    def edit(self, annotation, title, content):
+        """
+        queues an edit of an annotation, called before its title and content are changed
+        """
+        self.put(self.journal.operation('edit', annotation, title=title, content=content))
+
+    def delete(self, annotation):
+        self.put(self.journal.operation('delete', annotation))
+
+    def put(self, operation):
+        with self.condition:
+            if self.closed:
+                raise Exception("The annotation writer is closed")
+            self.pending.append(operation)
+            self.queued += 1
+            self.error = None
+            self.condition.notify_all()
+
+    def run(self):
+        """
+        body of the writer thread, waits for operations, collects the rest of their burst and writes them
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: (self.pending and self.error is None) or self.closed)
+                if not self.pending:
+                    return
+                self.condition.wait_for(lambda: self.flushing or self.closed, timeout=self.DELAY)
+                operations = self.pending
+                self.pending = []
+            try:
+                self.journal.write(operations)
+                error = None
+            except Exception as exception:
+                logging.error('Annotations could not be written to {}'.format(self.journal.path))
+                error = exception
+                self.errors.put(error)
+            with self.condition:
+                self.attempts += 1
+                self.error = error
+                if error is None:
+                    self.written += len(operations)
+                else:
+                    # kept before anything queued meanwhile so the journal stays in order
+                    self.pending[:0] = operations
+                self.condition.notify_all()
+                if self.closed and error is not None:
+                    return
+
+    def flush(self, timeout=None):
+        """
+        writes the queued operations now and waits for them, returns False if they could not be written
+        """
+        with self.condition:
+            target = self.queued
+            attempts = self.attempts
+            self.error = None
+            self.flushing = True
+            self.condition.notify_all()
+            self.condition.wait_for(
+                lambda: self.written >= target or (self.error is not None and self.attempts > attempts), timeout)
+            self.flushing = False
+            return self.written >= target
+
+    def close(self, timeout=None):
+        """
+        writes the queued operations and stops the thread, returns False if some could not be written
+        """
+        written = self.flush(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        self.running.discard(self)
+        return written
+
+    @classmethod
+    def close_all(cls, timeout=None):
+        """
+        closes every running writer, returns False if some operations could not be written
+        """
+        return all([writer.close(timeout) for writer in list(cls.running)])
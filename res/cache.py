@@ -0,0 +1,91 @@
+import numpy as np
+import os
+import json
+import hashlib
+import tempfile
+import logging
+
+
+class DecodeCache:
+    """
+    Versioned binary sidecar holding what was computed from a project's files, like the timebase parameters
+    and the decimation levels. It is keyed by the names, sizes and mtimes of those files, so a changed file
+    invalidates it, and it is written atomically. Stored next to the project unless directory is set.
+    """
+    VERSION = 3
+    FILENAME = '.brainwave_cache.npz'
+    # directory to keep the caches of all projects in, set from BRAINWAVE_CACHE_DIR when present
+    directory = os.environ.get('BRAINWAVE_CACHE_DIR')
+
+    def __init__(self, project_path, files):
+        self.files = list(files)
+        if self.directory:
+            name = hashlib.sha1(os.path.abspath(project_path).encode()).hexdigest()
+            self.path = os.path.join(self.directory, name + '.npz')
+        else:
+            self.path = os.path.join(project_path, self.FILENAME)
+        self.key = self.fingerprint()
+        self.entries = None
+
+    def fingerprint(self):
+        """
+        returns the cache key, the name, size and mtime of every source file as a json string
+        """
+        stats = []
+        for filename in self.files:
+            stat = os.stat(filename)
+            stats.append([os.path.basename(filename), stat.st_size, stat.st_mtime_ns])
+        return json.dumps([self.VERSION, stats])
+
+    def load(self):
+        """
+        reads the cache file once, returns its entries or an empty dict if it is missing, stale or unreadable
+        """
+        if self.entries is not None:
+            return self.entries
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return self.entries
+        try:
+            with np.load(self.path, allow_pickle=False) as cached:
+                if str(cached['key']) != self.key:
+                    logging.info('Decode cache at {} is stale'.format(self.path))
+                    return self.entries
+                self.entries = {name: cached[name] for name in cached.files if name != 'key'}
+            logging.info('Loaded decode cache from {}'.format(self.path))
+        except Exception:
+            logging.warning('Decode cache at {} could not be read'.format(self.path))
+        return self.entries
+
+    def get(self, name):
+        return self.load().get(name)
+
+    def update(self, arrays):
+        """
+        adds the given arrays to the cache and rewrites it atomically, failures only disable caching.
+        Nothing is written once the source files changed, like a recording still being written,
+        as the cache would be thrown away as stale on the next open anyway.
+        """
+        try:
+            if self.fingerprint() != self.key:
+                logging.info('Not updating decode cache at {}, its files changed'.format(self.path))
+                return
+        except OSError:
+            return
+        entries = dict(self.load())
+        entries.update(arrays)
+        directory = os.path.dirname(self.path) or '.'
+        temp_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as outfile:
+                np.savez(outfile, key=np.array(self.key), **entries)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+            self.entries = entries
+            logging.info('Saved decode cache to {}'.format(self.path))
+        except Exception:
+            logging.warning('Decode cache at {} could not be written'.format(self.path))
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
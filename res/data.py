@@ -1,21 +1,126 @@
-import struct
 import numpy as np
 import os
 import re
 import datetime
-from annotations import open_json
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.dates import date2num
+from annotations import AnnotationJournal
+from cache import DecodeCache
+from pyramid import MinMaxPyramid
+import instrument
 import logging
 
 
-def open_project(path):
+# default number of threads used to map segments and build the min/max pyramid
+WORKERS = min(8, os.cpu_count() or 1)
+
+
+class LoadCancelled(Exception):
+    """
+    Exception raised in a loading thread once the LoadProgress it reports to has been cancelled.
+    """
+    pass
+
+
+class LoadProgress:
+    """
+    Shared between a loading thread and the UI, counts the segments mapped and the bytes read
+    and lets the UI cancel the load.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.segments = 0
+        self.total_segments = 0
+        self.bytes_read = 0
+        self.total_bytes = 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        """
+        raises LoadCancelled if the load was cancelled, called by the loader between units of work
+        """
+        if self.cancelled.is_set():
+            raise LoadCancelled("Loading was cancelled")
+
+    def add(self, segments=0, bytes_read=0):
+        with self.lock:
+            self.segments += segments
+            self.bytes_read += bytes_read
+        self.check()
+
+
+def open_project(path, workers=WORKERS, progress=None):
     """
-        Given a directory path, open_project opens each .wav file as a numpy array,
-        stacks all of them into a single numpy array and returns it as the first element in result,
-        the timestamp as a datetime object as the second element in result
+        Given a directory path, open_project memory-maps each .wav file on up to workers threads,
+        joins all of them into a single Recording and returns it as the first element in result,
+        the timestamps as a Timebase as the second element in result
         and a list of Annotation objects  as the third element in result if a json file is present,
         else it returns an empty list.
+        If a LoadProgress is given the mapped segments are counted on it and the load can be cancelled through it.
     """
     logging.info('Opening project at path: {}'.format(path))
+    with instrument.span('open_project', path=path) as project_span:
+        with instrument.span('scan_directory'):
+            calfile, datafiles, jsonfile = scan_project(path)
+        segments = []
+        total_bytes = sum(os.path.getsize(file) for file in datafiles)
+        if progress is not None:
+            progress.total_segments = len(datafiles)
+            progress.total_bytes = total_bytes
+
+        logging.info('Mapping recording from data')
+        with instrument.span('map_segments', segments=len(datafiles), workers=workers) as span:
+            span.count(total_bytes)
+            # memory-map the datafiles on a pool, nothing is read until a view needs it
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = [executor.submit(map_wav, file) for file in datafiles]
+                # collect in sorted order so the first failing segment is the one reported
+                for file, segment in zip(datafiles, pending):
+                    try:
+                        segments.append(segment.result())
+                    except Exception:
+                        logging.error('.wav file at {} could not be read'.format(file))
+                        raise Exception("One of the data files could not be read")
+                    if progress is not None:
+                        progress.add(segments=1)
+            data = Recording(segments, cache=DecodeCache(
+                path, datafiles + ([calfile] if calfile != "" else [])), workers=workers, files=datafiles)
+        project_span.count(total_bytes)
+
+        # create timestamps
+        logging.info('Creating timestamps')
+        timestamps = None
+        if calfile != "":
+            with instrument.span('build_timestamps') as span:
+                timestamps = Timebase.from_array(data.cache.get('timebase'), len(data))
+                if timestamps is None:
+                    try:
+                        logging.info('Reading calibration checkpoints')
+                        span.count(os.path.getsize(calfile))
+                        initial_time, checkpoints = get_checkpoints(calfile)
+                    except Exception:
+                        logging.info('.cal file at {} could not be read'.format(calfile))
+                        raise Exception("The .cal file could not be read")
+                    timestamps = Timebase(initial_time, len(data), checkpoints=checkpoints)
+                    data.cache.update({'timebase': timestamps.to_array()})
+                data.timestamps = timestamps
+        annotations = load_annotations(path, jsonfile, timestamps)
+    logging.info('Finished opening project')
+    return data, timestamps, annotations
+
+
+def scan_project(path):
+    """
+    Returns the .cal file, the .wav segments in segment order and the .json file in the directory path,
+    the .cal and .json files as "" when there are none
+    """
     contents = os.listdir(path)
     calfile = ""
     datafiles = []
@@ -29,51 +134,154 @@ def open_project(path):
         elif re.match(r'\d{2}-\d{2}-\d{4}_\d{2}_\d{2}_\d{2}_\d{1,4}_\d*.wav', filepath):
             logging.info('Found datafile: {}'.format(filepath))
             datafiles.append(path + filepath)
-        elif re.match(r'.*\.json', filepath):
+        elif re.match(r'.*\.json$', filepath):
             logging.info('Found jsonfile: {}'.format(filepath))
             jsonfile = path + filepath
     # sort datafiles to obtain the correct order of data
-    datafiles.sort()
-    raw_data = []
+    datafiles.sort(key=segment_key)
+    return calfile, datafiles, jsonfile
 
-    logging.info('Creating numpy array from data')
-    # create a numpy array from the datafiles
-    for file in datafiles:
-        try:
-            tmp_data = read_wav(file)
-        except Exception:
-            logging.error('.wav file at {} could not be read'.format(file))
-            raise Exception("One of the data files could not be read")
-        raw_data.append(tmp_data)
-    data = np.hstack(raw_data)
-    data = data / 10
-
-    # create timestamps
-    logging.info('Creating timestamps')
-    timestamps = None
-    if calfile != "":
-        try:
-            logging.info('Getting initial timestamp')
-            initial_time = get_initial_timestamp(calfile)
-        except Exception:
-            logging.info('.cal file at {} could not be read'.format(calfile))
-            raise Exception("The .cal file could not be read")
-        timestamps = np.arange(
-            data.shape[0]) * datetime.timedelta(microseconds=1000 * 20)
-        timestamps += initial_time
-    # load annotations
+
+def load_annotations(path, jsonfile="", timestamps=None):
+    """
+    Returns the annotations of the project at path with the changes in its journal applied, an empty list
+    if it has none, or [-1, message] if they could not be read. Annotations saved on the timebase of earlier
+    builds are moved onto timestamps, see annotation_converter
+    """
     annotations = []
-    if jsonfile != "":
+    journal = AnnotationJournal(jsonfile if jsonfile != "" else path + "annotations.json",
+                                annotation_converter(timestamps))
+    if journal.exists():
         logging.info('Loading annotations')
-        try:
-            annotations = open_json(jsonfile)
-        except Exception:
-            logging.warning(
-                'The annotations could not be loaded from file at {}'.format(jsonfile))
-            annotations = [-1,
-                           "The annotation file is in an incorrect format."]
-    logging.info('Finished opening project')
-    return data, timestamps, annotations
+        with instrument.span('load_annotations'):
+            try:
+                annotations = journal.load()
+            except Exception:
+                logging.warning(
+                    'The annotations could not be loaded from file at {}'.format(journal.filename))
+                annotations = [-1,
+                               "The annotation file is in an incorrect format."]
+    return annotations
+
+
+def annotation_converter(timestamps):
+    """
+    returns the function moving the times of annotations saved on the uniform timebase of earlier builds
+    onto timestamps, None when there are no timestamps to move them onto
+    """
+    return timestamps.from_uniform if timestamps is not None else None
+
+
+class RecordingCache:
+    """
+    Process-wide cache of opened recordings, so windows showing the same unchanged project share one Recording
+    and Timebase instead of decoding it again. Entries are keyed by the project path and the names, sizes and
+    mtimes of its files, and count the owners using them. An entry is kept after its last owner releases it,
+    for reopening, until the recordings held go over budget bytes, then the least recently used unowned ones go.
+    The shared recording is read-only, owners must not change it other than by refresh.
+    """
+    # bytes of recordings to keep, set in MB from BRAINWAVE_RECORDING_CACHE_MB when present
+    budget = int(float(os.environ.get('BRAINWAVE_RECORDING_CACHE_MB', 1024)) * 2**20)
+
+    def __init__(self, budget=None):
+        if budget is not None:
+            self.budget = budget
+        self.lock = threading.Lock()
+        # key to [recording, timestamps, owners], least recently used first
+        self.entries = OrderedDict()
+        self.loads = {}
+
+    @contextlib.contextmanager
+    def loading(self, key):
+        """
+        holds the lock of a key while its project is opened, so a project opened in two windows at once is decoded once
+        """
+        with self.lock:
+            lock = self.loads.setdefault(key, threading.Lock())
+        with lock:
+            yield
+
+    def open(self, path, owner, workers=WORKERS, progress=None):
+        """
+        returns the recording, timestamps and annotations of the project at path like open_project, and adds
+        owner to the users of the recording until it is released. The recording comes from the cache when
+        the project is unchanged, else it is opened and its pyramid built. Annotations are always read again.
+        """
+        calfile, datafiles, jsonfile = scan_project(path)
+        key = (os.path.abspath(path), DecodeCache(path, datafiles + ([calfile] if calfile != "" else [])).key)
+        with self.loading(key):
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is None:
+                recording, timestamps, annotations = open_project(path, workers, progress)
+                recording.build_pyramid(progress)
+                entry = [recording, timestamps, []]
+            else:
+                logging.info('Sharing the opened recording of {}'.format(path))
+                annotations = load_annotations(path, jsonfile, entry[1])
+            with self.lock:
+                # checked under the lock so an owner that cancelled and released is never added after
+                if progress is not None:
+                    progress.check()
+                entry[2].append(owner)
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                for other in [other for other in self.entries if other[0] == key[0] and other != key]:
+                    # an older version of the same project is not opened again
+                    if not self.entries[other][2]:
+                        del self.entries[other]
+                self.evict()
+        return entry[0], entry[1], annotations
+
+    def release(self, owner, recording=None):
+        """
+        removes owner from the users of recording, or of every recording it uses when recording is None,
+        then evicts unowned recordings over the budget
+        """
+        with self.lock:
+            for entry in self.entries.values():
+                if recording is None:
+                    entry[2][:] = [user for user in entry[2] if user is not owner]
+                elif entry[0] is recording and owner in entry[2]:
+                    entry[2].remove(owner)
+            self.evict()
+
+    def evict(self):
+        """
+        drops the least recently used unowned recordings until the cached ones fit the budget, called with the lock
+        """
+        size = sum(entry[0].nbytes for entry in self.entries.values())
+        for key, entry in list(self.entries.items()):
+            if size <= self.budget:
+                break
+            if not entry[2]:
+                logging.info('Evicting the recording of {} from the cache'.format(key[0]))
+                size -= entry[0].nbytes
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# the recording cache shared by every window of the application
+recordings = RecordingCache()
+
+
+def segment_key(filename):
+    """
+    Sort key for .wav segments, orders them by their segment number so segment 10 comes after segment 9
+    """
+    match = re.match(r'.*_(\d{1,4})_\d*\.wav$', os.path.basename(filename))
+    return (int(match.group(1)) if match else -1, filename)
+
+
+def find_datafiles(path):
+    """
+    Returns the .wav segments in the directory path, in segment order
+    """
+    return sorted((path + filepath for filepath in os.listdir(path) if re.match(
+        r'\d{2}-\d{2}-\d{4}_\d{2}_\d{2}_\d{2}_\d{1,4}_\d*.wav', filepath)), key=segment_key)
 
 
 def check_valid_path(path):
@@ -113,18 +321,388 @@ def check_valid_path(path):
 def read_wav(filename):
     """
         Reads a single wav file in the format of two bytes is equal to one ICB reading and returns it as a numpy array
+        of little-endian int16 values, decoded in a single call. A trailing odd byte repeats the last full reading.
     """
     logging.info('Reading .wav file at {}'.format(filename))
-    frames = []
-    with open(filename, 'rb') as infile:
-        raw_data = infile.read(2)
-        data = struct.unpack('h', raw_data)[0]
-        while raw_data != b"":
-            frames.append(data)
-            raw_data = infile.read(2)
-            if len(raw_data) == 2:
-                data = struct.unpack('h', raw_data)[0]
-    return np.array(frames)
+    with instrument.span('read_wav', file=filename) as span, open(filename, 'rb') as infile:
+        raw_data = infile.read()
+        span.count(len(raw_data))
+    if len(raw_data) < 2:
+        raise Exception("The .wav file at {} contains no readings".format(filename))
+    frames = np.frombuffer(raw_data, dtype='<i2', count=len(raw_data) // 2)
+    if len(raw_data) % 2:
+        frames = np.append(frames, frames[-1])
+    return frames
+
+
+def map_wav(filename):
+    """
+        Memory-maps a single wav file as a read-only array of little-endian int16 ICB readings without reading it,
+        a trailing odd byte repeats the last full reading like read_wav does.
+    """
+    logging.info('Mapping .wav file at {}'.format(filename))
+    size = os.path.getsize(filename)
+    if size < 2:
+        raise Exception("The .wav file at {} contains no readings".format(filename))
+    frames = np.memmap(filename, dtype='<i2', mode='r', shape=(size // 2,))
+    if size % 2:
+        return [frames, np.array(frames[-1:])]
+    return [frames]
+
+
+class Recording:
+    """
+    A recording made of consecutive .wav segments, exposed as one virtual array of calibrated readings.
+    Segments stay memory-mapped as raw int16 and only the pages backing a requested slice are read,
+    the calibration factor is applied to those readings only when they are asked for.
+    Supports len(), slicing by sample index and slicing by time through time_slice.
+    """
+    SCALE = 10
+
+    def __init__(self, segments, timestamps=None, cache=None, workers=1, files=None):
+        # a segment is a list of int16 chunks, as returned by map_wav
+        self.segments = [list(segment) for segment in segments]
+        self.join()
+        # the .wav files the segments were mapped from and their sizes then, used by refresh
+        self.files = list(files or [])
+        self.sizes = [os.path.getsize(file) for file in self.files]
+        self.timestamps = timestamps
+        self.cache = cache
+        self.workers = workers
+        self._pyramid = None
+        # BandPower of the recording for each (window, hop) computed, see spectral.band_power
+        self.spectra = {}
+
+    def join(self):
+        """
+        flattens the segments into the chunk list and offsets the readings are looked up in
+        """
+        self.chunks = [chunk for segment in self.segments for chunk in segment if len(chunk)]
+        self.offsets = np.cumsum([0] + [len(chunk) for chunk in self.chunks])
+
+    def refresh(self):
+        """
+        maps the readings appended to the last segment and any new segments since the recording was opened,
+        for recordings that are still being written. Nothing is copied, the grown last segment is just mapped again.
+        Returns the index of the first reading that changed, or None if nothing did.
+        """
+        if not self.files:
+            return None
+        changed = None
+        last = len(self.files) - 1
+        known = set(self.files)
+        candidates = [self.files[last]] + [file for file in find_datafiles(os.path.dirname(self.files[last]) + "/")
+                                           if file not in known and segment_key(file) > segment_key(self.files[last])]
+        for file in candidates:
+            size = os.path.getsize(file)
+            if file == self.files[last]:
+                if size == self.sizes[last]:
+                    continue
+                # the grown segment replaces its old mapping, its readings up to the old size are unchanged
+                # apart from a repeated odd-byte reading, which is replaced by the real one
+                self.files.pop()
+                start = len(self) - sum(len(chunk) for chunk in self.segments.pop()) + self.sizes.pop() // 2
+            elif size < 2:
+                # a new segment without readings yet is picked up on a later refresh
+                break
+            else:
+                start = len(self)
+            self.segments.append(map_wav(file))
+            self.files.append(file)
+            self.sizes.append(size)
+            self.join()
+            changed = start if changed is None else min(changed, start)
+        if changed is not None:
+            logging.info('Recording grew to {} readings'.format(len(self)))
+            if self.timestamps is not None:
+                self.timestamps.length = len(self)
+            if self._pyramid is not None:
+                self._pyramid.extend(changed)
+        return changed
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def nbytes(self):
+        """
+        the bytes held for the recording, its mapped readings, its min/max pyramid once built and its band powers
+        """
+        size = sum(chunk.nbytes for chunk in self.chunks)
+        if self._pyramid is not None:
+            size += sum(buffer.nbytes for buffers in self._pyramid.buffers for buffer in buffers)
+        return size + sum(power.power.nbytes for power in list(self.spectra.values()))
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            raise IndexError("A Recording is indexed by a single slice, index or array of indices")
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return self.read(start, stop)
+            return self.gather(np.arange(start, stop, step))
+        if isinstance(key, (int, np.integer)):
+            index = key + len(self) if key < 0 else key
+            if not 0 <= index < len(self):
+                raise IndexError("Recording index out of range")
+            return self.read(index, index + 1)[0]
+        indices = np.asarray(key)
+        if indices.dtype == bool:
+            if indices.shape != (len(self),):
+                raise IndexError("A boolean mask must have one entry per reading")
+            indices = np.flatnonzero(indices)
+        indices = np.where(indices < 0, indices + len(self), indices).astype(np.int64)
+        if indices.size and not (0 <= indices.min() and indices.max() < len(self)):
+            raise IndexError("Recording index out of range")
+        return self.gather(indices)
+
+    def gather(self, indices):
+        """
+        returns the calibrated readings at in-range sample indices, taking from each chunk only the readings
+        it holds, so strided and fancy keys read only the pages of the readings they name
+        """
+        values = np.empty(indices.shape, dtype='<i2')
+        chunk = np.searchsorted(self.offsets, indices, side='right') - 1
+        for i in np.unique(chunk):
+            inside = chunk == i
+            values[inside] = self.chunks[i][indices[inside] - self.offsets[i]]
+        return self.calibrate(values)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.read(0, len(self))
+        return values if dtype is None else values.astype(dtype)
+
+    @property
+    def pyramid(self):
+        """
+        the min/max pyramid of the recording, restored from the decode cache when possible, else built on first use
+        """
+        return self.build_pyramid()
+
+    def build_pyramid(self, progress=None):
+        """
+        restores or builds the min/max pyramid once, the bytes read while building are counted on progress
+        """
+        if self._pyramid is None:
+            with instrument.span('build_pyramid', readings=len(self)) as span:
+                self._pyramid = MinMaxPyramid(
+                    self, None if self.cache is None else self.cache.load(), self.workers, progress)
+                if self.cache is not None and not self._pyramid.restored:
+                    span.count(2 * len(self))
+                    self.cache.update(self._pyramid.to_arrays())
+        return self._pyramid
+
+    def raw(self, start, stop):
+        """
+        returns the uncalibrated int16 readings for the sample indices in [start, stop)
+        """
+        stop = max(start, min(stop, len(self)))
+        first = max(0, np.searchsorted(self.offsets, start, side='right') - 1)
+        last = np.searchsorted(self.offsets, stop, side='left')
+        pieces = []
+        for i in range(first, last):
+            offset = self.offsets[i]
+            pieces.append(self.chunks[i][max(start - offset, 0):stop - offset])
+        if len(pieces) == 1:
+            return np.asarray(pieces[0])
+        if not pieces:
+            return np.empty(0, dtype='<i2')
+        return np.concatenate(pieces)
+
+    def read(self, start, stop):
+        """
+        returns the calibrated readings for the sample indices in [start, stop)
+        """
+        return self.calibrate(self.raw(start, stop))
+
+    def calibrate(self, values):
+        """
+        applies the calibration factor to raw readings, either a single value or an array
+        """
+        return values / self.SCALE
+
+    def extrema(self, start, stop):
+        """
+        returns the calibrated (max, min) of the readings in [start, stop), answered by the min/max pyramid
+        on the raw int16 readings in O(log n)
+        """
+        vmax, vmin = self.pyramid.extrema(start, stop)
+        return self.calibrate(vmax), self.calibrate(vmin)
+
+    def time_range(self, start, end):
+        """
+        returns the sample indices (first, last + 1) of the readings strictly between the start and end times
+        """
+        return (self.timestamps.searchsorted(start, side='right'),
+                self.timestamps.searchsorted(end, side='left'))
+
+    def span_range(self, start, end):
+        """
+        returns the sample indices (first, last + 1) of the readings from the start to the end time included, as
+        span annotations are snapped to readings, and at least the reading at start when there is none in between
+        """
+        first = min(self.timestamps.searchsorted(start, side='left'), len(self) - 1)
+        return first, max(self.timestamps.searchsorted(end, side='right'), first + 1)
+
+    def time_slice(self, start, end):
+        """
+        returns the calibrated readings strictly between the start and end times
+        """
+        return self.read(*self.time_range(start, end))
+
+
+class Timebase:
+    """
+    The implicit timestamps of a recording, piecewise linear between the checkpoints of the .cal file.
+    Checkpoint k is taken every step readings, so the reading at index i falls between checkpoints i // step
+    and i // step + 1 and is interpolated between their times. Before the first and after the last checkpoint
+    readings are period apart. Conversions between indices and times are binary searches over the
+    checkpoints and timestamp arrays are only built for the slices asked for.
+    """
+    US = datetime.timedelta(microseconds=1)
+
+    def __init__(self, start, length, period=datetime.timedelta(milliseconds=20), checkpoints=None, step=None):
+        self.start = start
+        self.length = length
+        self.period = period
+        self.period_us = period / self.US
+        # microseconds after start of every checkpoint, the first one is start itself
+        checkpoints = np.zeros(1, dtype=np.int64) if checkpoints is None else np.asarray(checkpoints, dtype=np.int64)
+        if step is None:
+            # the checkpoints are a fixed number of readings apart, at the nominal period that is the usual gap
+            step = int(round(np.median(np.diff(checkpoints)) / self.period_us)) if len(checkpoints) > 1 else 1
+        self.step = max(step, 1)
+        self.checkpoints = checkpoints
+        # a checkpoint not after the ones before it is a clock glitch and left out
+        keep = np.ones(len(checkpoints), dtype=bool)
+        keep[1:] = checkpoints[1:] > np.maximum.accumulate(checkpoints)[:-1]
+        self.knots = np.flatnonzero(keep).astype(float) * self.step
+        self.offsets = checkpoints[keep].astype(float)
+
+    @classmethod
+    def from_array(cls, array, length):
+        """
+        restores a timebase saved with to_array, returns None if there is none
+        """
+        if array is None or len(array) < 4:
+            return None
+        start, period = (datetime.timedelta(microseconds=int(value)) for value in array[:2])
+        return cls(datetime.datetime(1970, 1, 1) + start, length, period, checkpoints=array[3:], step=int(array[2]))
+
+    def to_array(self):
+        """
+        returns the start time, period, step and checkpoints in microseconds as an int64 array,
+        to be stored in a DecodeCache
+        """
+        header = [(self.start - datetime.datetime(1970, 1, 1)) // self.US, self.period // self.US, self.step]
+        return np.concatenate([np.array(header, dtype=np.int64), self.checkpoints])
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            offsets = self.offsets_of(np.arange(start, stop, step))
+            return np.datetime64(self.start, 'us') + np.rint(offsets).astype(np.int64) * np.timedelta64(1, 'us')
+        index = key + self.length if key < 0 else key
+        if not 0 <= index < self.length:
+            raise IndexError("Timebase index out of range")
+        return self.time_of(index)
+
+    @property
+    def end(self):
+        return self.time_of(self.length - 1)
+
+    def offsets_of(self, indices):
+        """
+        returns the microseconds after start of (possibly fractional) reading indices
+        """
+        indices = np.asarray(indices, dtype=float)
+        offsets = np.interp(indices, self.knots, self.offsets)
+        offsets = np.where(indices > self.knots[-1],
+                           self.offsets[-1] + (indices - self.knots[-1]) * self.period_us, offsets)
+        return np.where(indices < 0, indices * self.period_us, offsets)
+
+    def indices_of(self, offsets):
+        """
+        returns the fractional reading indices at microseconds after start, the inverse of offsets_of
+        """
+        offsets = np.asarray(offsets, dtype=float)
+        indices = np.interp(offsets, self.offsets, self.knots)
+        indices = np.where(offsets > self.offsets[-1],
+                           self.knots[-1] + (offsets - self.offsets[-1]) / self.period_us, indices)
+        return np.where(offsets < 0, offsets / self.period_us, indices)
+
+    def offset_of(self, index):
+        """
+        returns the microseconds after start of the reading at index, rounded as in its timestamp
+        """
+        return int(np.rint(self.offsets_of(index)))
+
+    def time_of(self, index):
+        """
+        returns the time of the reading at index as a datetime
+        """
+        return self.start + datetime.timedelta(microseconds=self.offset_of(index))
+
+    def from_uniform(self, time):
+        """
+        returns the time of the reading that was at time on the uniform start + i * period timebase used before
+        the checkpoints, so annotations saved then stay on the readings they were made on. Between readings
+        the fractional index is kept
+        """
+        index = ((time - self.start) // self.US) / self.period_us
+        return self.start + datetime.timedelta(microseconds=int(np.rint(self.offsets_of(index))))
+
+    def index_of(self, time):
+        """
+        returns the index of the last reading taken at or before time, clipped to the recording
+        """
+        return min(max(self.searchsorted(time, side='right') - 1, 0), self.length - 1)
+
+    def searchsorted(self, time, side='left'):
+        """
+        equivalent of np.searchsorted over the full timestamp array, returns the index where time would be inserted
+        """
+        target = (time - self.start) // self.US
+        if side == 'right':
+            def before(index):
+                return self.offset_of(index) <= target
+        else:
+            def before(index):
+                return self.offset_of(index) < target
+        index = int(min(max(np.ceil(self.indices_of(target)), 0), self.length))
+        # the estimate is off by at most a reading from rounding to microseconds
+        while index > 0 and not before(index - 1):
+            index -= 1
+        while index < self.length and before(index):
+            index += 1
+        return index
+
+    def dates(self, start, stop):
+        """
+        returns the matplotlib date numbers of the readings in [start, stop)
+        """
+        return self.nums(np.arange(start, stop))
+
+    def nums(self, indices):
+        """
+        returns the matplotlib date numbers of (possibly fractional) reading indices
+        """
+        return date2num(self.start) + self.offsets_of(indices) / (datetime.timedelta(days=1) / self.US)
+
+    def time_of_num(self, num):
+        """
+        returns the time of the reading nearest to a matplotlib date number, clipped to the recording
+        """
+        return self.time_of(min(max(int(np.rint(self.indices_of_nums(num))), 0), self.length - 1))
+
+    def indices_of_nums(self, nums):
+        """
+        returns the fractional reading indices of matplotlib date numbers, the inverse of nums
+        """
+        return self.indices_of((np.asarray(nums) - date2num(self.start)) * (datetime.timedelta(days=1) / self.US))
 
 
 def get_initial_timestamp(filename):
@@ -140,3 +718,37 @@ def get_initial_timestamp(filename):
         timestamp = datetime.datetime.strptime(
             match.group(1), '%d-%m-%Y %H:%M:%S')
         return timestamp
+
+
+def get_checkpoints(filename):
+    """
+        Reads the whole .cal file in one pass and returns the initial timestamp and the microseconds after it
+        of every calibration checkpoint, starting with the initial timestamp itself
+    """
+    initial_time = get_initial_timestamp(filename)
+    with open(filename, 'r') as infile:
+        # every line carries its date as well as its time, the first one included
+        fields = np.array(re.findall(r'(\d{2})-(\d{2})-(\d{4})\s+(\d{2}):(\d{2}):(\d{2})', infile.read()),
+                          dtype=np.int64).reshape(-1, 6)
+    days = checkpoint_days(fields)
+    seconds = (days - days[0]) * 86400 + fields[:, 3:] @ np.array([3600, 60, 1])
+    # a clock stepped back, by a resync or daylight saving, gives a checkpoint that does not increase,
+    # Timebase leaves those out as glitches
+    return initial_time, (seconds - seconds[0]) * 1000000
+
+
+def checkpoint_days(fields):
+    """
+    Returns the day number of every .cal line given its day, month, year, hour, minute and second fields.
+    Devices write the date day first or month first, the order whose consecutive lines are at most
+    a day apart is taken, day first when both are
+    """
+    for day, month in ((0, 1), (1, 0)):
+        try:
+            days = np.array(['{:04d}-{:02d}-{:02d}'.format(line[2], line[month], line[day]) for line in fields],
+                            dtype='datetime64[D]').astype(np.int64)
+        except ValueError:
+            continue
+        if np.all(np.abs(np.diff(days)) <= 1):
+            return days
+    raise Exception("The dates of the .cal file are not consecutive")
@@ -0,0 +1,143 @@
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.dates import date2num
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import os
+import logging
+import data
+import plotting
+from annotations import AnnotationStore
+
+FORMATS = ('pdf', 'png')
+# strips on each page of a paginated export, and the A4 landscape page they are drawn on
+ROWS = 6
+PAGESIZE = (11.69, 8.27)
+
+
+def open_for_export(path):
+    """
+    opens the project at path, returns the recording and its annotations as an AnnotationStore
+    """
+    recording, timestamps, annotations = data.open_project(path)
+    if annotations and annotations[0] == -1:
+        logging.warning('Exporting {} without annotations: {}'.format(path, annotations[1]))
+        annotations = []
+    return recording, AnnotationStore(annotations)
+
+
+def project_figures(recording, annotations):
+    """
+    draws the main graph with annotations and the reference graph of a recording, as they first appear
+    in the application, on Agg figures without pyplot or Tk
+    """
+    main = Figure(figsize=plotting.FIGSIZE)
+    FigureCanvasAgg(main)
+    main_ax = main.add_subplot()
+    plotting.style_figure(main, main_ax)
+    line, spans, points = plotting.draw_main(main_ax, recording)
+    plotting.set_annotation_shapes(spans, points, [plotting.annotation_shape(a, recording) for a in annotations])
+    reference = Figure(figsize=plotting.FIGSIZE)
+    FigureCanvasAgg(reference)
+    reference_ax = reference.add_subplot()
+    plotting.style_figure(reference, reference_ax)
+    plotting.draw_reference(reference_ax, recording)
+    return main, reference
+
+
+def export_pages(recording, annotations, filename, row_seconds, rows=ROWS, title=''):
+    """
+    writes the whole recording to a pdf as strips of row_seconds each, rows strips per page, with the
+    annotations overlapping each strip drawn over it. Pages are drawn one at a time on a single figure and
+    streamed to the file, each reading only the envelope of its own strips, so memory stays bounded.
+    Returns the number of pages written.
+    """
+    timestamps = recording.timestamps
+    row = datetime.timedelta(seconds=row_seconds)
+    strips = max(-(-(timestamps.end - timestamps.start) // row), 1)
+    pages = -(-strips // rows)
+    figure = Figure(figsize=PAGESIZE)
+    FigureCanvasAgg(figure)
+    figure.set_facecolor('white')
+    axes = figure.subplots(rows, 1, squeeze=False)[:, 0]
+    lines = []
+    collections = []
+    for ax in axes:
+        line, spans, points = plotting.setup_main(ax)
+        line.set_linewidth(0.75)
+        ax.tick_params(labelsize=7)
+        lines.append(line)
+        collections.append((spans, points))
+    figure.subplots_adjust(left=0.06, right=0.98, bottom=0.05, top=0.93, hspace=0.45)
+    logging.info('Exporting {} pages of {} s strips to {}'.format(pages, row_seconds, filename))
+    with PdfPages(filename) as export_pdf:
+        for page in range(pages):
+            figure.suptitle('{}  page {} of {}'.format(title, page + 1, pages))
+            for i, ax in enumerate(axes):
+                strip = page * rows + i
+                start = timestamps.start + strip * row
+                ax.set_visible(strip < strips)
+                if strip >= strips:
+                    continue
+                first = timestamps.searchsorted(start)
+                # the last strip also takes a reading at its very end, which no later strip would
+                last = timestamps.searchsorted(start + row, side='right' if strip == strips - 1 else 'left')
+                indices, values = recording.pyramid.envelope(first, last, ax.get_window_extent().width)
+                lines[i].set_data(timestamps.nums(indices), values)
+                ax.set_xlim(date2num(start), date2num(start + row))
+                if last > first:
+                    vmax, vmin = recording.extrema(first, last)
+                    margin = max((vmax - vmin) * 0.05, 1)
+                    ax.set_ylim(vmin - margin, vmax + margin)
+                shapes = [plotting.annotation_shape(a, recording) for a in annotations.overlapping(start, start + row)]
+                plotting.set_annotation_shapes(*collections[i], shapes)
+            export_pdf.savefig(figure)
+    return pages
+
+
+def export_project(path, output=None, formats=FORMATS, row_seconds=None, rows=ROWS):
+    """
+    renders the project at path to output, by default the project directory, as a two page pdf
+    like the export button and as one png per graph, and as paginated strips of row_seconds when it is given,
+    returns the files written
+    """
+    path = os.path.join(path, '')
+    data.check_valid_path(path)
+    output = path if output is None else output
+    name = os.path.basename(os.path.dirname(path))
+    logging.info('Exporting {} to {}'.format(path, output))
+    recording, annotations = open_for_export(path)
+    main, reference = project_figures(recording, annotations)
+    files = []
+    if 'pdf' in formats:
+        filename = os.path.join(output, name + '.pdf')
+        with PdfPages(filename) as export_pdf:
+            export_pdf.savefig(main)
+            export_pdf.savefig(reference)
+        files.append(filename)
+    if 'png' in formats:
+        for figure, suffix in ((main, '_main.png'), (reference, '_reference.png')):
+            filename = os.path.join(output, name + suffix)
+            figure.savefig(filename)
+            files.append(filename)
+    if row_seconds is not None:
+        filename = os.path.join(output, name + '_pages.pdf')
+        export_pages(recording, annotations, filename, row_seconds, rows, title=name)
+        files.append(filename)
+    return files
+
+
+def export_projects(paths, output=None, formats=FORMATS, workers=None, row_seconds=None, rows=ROWS):
+    """
+    exports every project in paths on a pool of up to workers processes, yields (path, files, error)
+    in the order of paths, with error None when the project was exported
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = [executor.submit(export_project, path, output, formats, row_seconds, rows) for path in paths]
+        for path, export in zip(paths, pending):
+            try:
+                yield path, export.result(), None
+            except Exception as error:
+                logging.error('Project at {} could not be exported'.format(path))
+                yield path, [], error
@@ -0,0 +1,198 @@
+"""
+Structured timing and memory instrumentation. Code to be measured runs in a span,
+
+    with instrument.span('read_wav', file=filename) as span:
+        ...
+        span.count(len(raw_data))
+
+and while tracing is on every span writes one record with its duration, the bytes it counted and how much
+the resident memory grew, nested under the span it ran in on the same thread. Records are written as json
+lines, or as a Chrome trace for chrome://tracing or Perfetto when the file ends in .json. Tracing is switched
+on with start, or at import by setting BRAINWAVE_TRACE to the file to write, and off with stop.
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+try:
+    import psutil
+except ImportError:
+    # optional, without it resident memory is read from the Windows API or from /proc
+    psutil = None
+if os.name == 'nt':
+    import ctypes
+    from ctypes import wintypes
+
+    class MemoryCounters(ctypes.Structure):
+        """
+        PROCESS_MEMORY_COUNTERS of GetProcessMemoryInfo, WorkingSetSize is the resident memory
+        """
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    ctypes.windll.kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    ctypes.windll.psapi.GetProcessMemoryInfo.argtypes = [
+        wintypes.HANDLE, ctypes.POINTER(MemoryCounters), wintypes.DWORD]
+    ctypes.windll.psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+
+
+lock = threading.Lock()
+local = threading.local()
+sink = None
+chrome = False
+first = True
+
+
+def resident_bytes():
+    """
+    returns the resident memory of this process in bytes, or None where it cannot be read
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if os.name == 'nt':
+        counters = MemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters.WorkingSetSize
+    try:
+        with open('/proc/self/statm') as infile:
+            return int(infile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return None
+
+
+def start(filename, chrome_trace=None):
+    """
+    starts writing a record for every span to filename, as a Chrome trace if chrome_trace is set
+    or by default when filename ends in .json, else as json lines
+    """
+    global sink, chrome, first
+    stop()
+    with lock:
+        chrome = filename.endswith('.json') if chrome_trace is None else chrome_trace
+        sink = open(filename, 'w')
+        first = True
+        if chrome:
+            sink.write('[\n')
+    logging.info('Tracing to {}'.format(filename))
+
+
+def stop():
+    """
+    stops tracing and closes the trace file, if tracing is on
+    """
+    global sink
+    with lock:
+        if sink is None:
+            return
+        if chrome:
+            sink.write('\n]\n')
+        sink.close()
+        sink = None
+    logging.info('Tracing stopped')
+
+
+def enabled():
+    return sink is not None
+
+
+def span(name, **fields):
+    """
+    returns a context manager timing the code it runs as name, fields are added to its record
+    """
+    if sink is None:
+        return NULL_SPAN
+    return Span(name, fields)
+
+
+class Span:
+    """
+    A timed region of code, nested under the span open on its thread when it started
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.bytes = 0
+
+    def count(self, nbytes):
+        """
+        adds to the bytes processed in this span
+        """
+        self.bytes += int(nbytes)
+
+    def __enter__(self):
+        stack = getattr(local, 'stack', None)
+        if stack is None:
+            stack = local.stack = []
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+        self.rss = resident_bytes()
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        local.stack.pop()
+        rss = resident_bytes()
+        rss_delta = rss - self.rss if rss is not None and self.rss is not None else None
+        write(self, duration, rss, rss_delta, exc_type)
+        return False
+
+
+class NullSpan:
+    """
+    Stands in for a span while tracing is off, so spans cost next to nothing
+    """
+
+    def count(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def write(span, duration, rss, rss_delta, exc_type):
+    """
+    writes the record of a finished span
+    """
+    global first
+    fields = dict(span.fields, bytes=span.bytes, rss=rss, rss_delta=rss_delta)
+    if exc_type is not None:
+        fields['error'] = exc_type.__name__
+    if chrome:
+        record = {'name': span.name, 'ph': 'X', 'ts': span.wall * 1e6, 'dur': duration * 1e6,
+                  'pid': os.getpid(), 'tid': threading.get_ident(), 'args': fields}
+    else:
+        record = dict(fields, name=span.name, start=span.wall, duration=duration, parent=span.parent,
+                      depth=span.depth, thread=threading.current_thread().name)
+    line = json.dumps(record, default=str)
+    with lock:
+        if sink is None:
+            return
+        if chrome:
+            line = ('' if first else ',\n') + line
+        else:
+            line += '\n'
+        first = False
+        sink.write(line)
+        sink.flush()
+
+
+if os.environ.get('BRAINWAVE_TRACE'):
+    start(os.environ['BRAINWAVE_TRACE'])
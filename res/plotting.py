@@ -0,0 +1,111 @@
+from matplotlib.collections import PolyCollection, LineCollection
+from matplotlib.dates import date2num
+
+# size in inches of the main and reference graphs
+FIGSIZE = (8, 3)
+# NHS blue for the main graph, cyan for the reference graph
+MAIN_COLOR = '#5436ff'
+REFERENCE_COLOR = 'cyan'
+# one color per frequency band of the band power graph, slowest first
+BAND_COLORS = ('#ff8c00', '#ffd700', '#7cfc00', '#ff69b4')
+
+
+def style_figure(figure, ax):
+    """
+    gives a figure and its axes the grey background of the application
+    """
+    figure.set_facecolor('xkcd:grey')
+    ax.set_facecolor('xkcd:dark grey')
+
+
+def envelope(data, start, stop, ax):
+    """
+    returns the date numbers and values needed to draw the readings in [start, stop) at the pixel width of ax
+    """
+    indices, values = data.pyramid.envelope(start, stop, ax.get_window_extent().width)
+    return data.timestamps.nums(indices), values
+
+
+def draw_main(ax, data, animated=False):
+    """
+    draws the whole recording on the main graph axes with empty annotation collections over it,
+    returns the line and the span and point collections. Animated collections are left out of full draws
+    so they can be blitted on their own.
+    """
+    line, spans, points = setup_main(ax, animated)
+    line.set_data(*envelope(data, 0, len(data), ax))
+    ax.relim()
+    ax.autoscale_view()
+    return line, spans, points
+
+
+def setup_main(ax, animated=False):
+    """
+    clears the main graph axes and styles them with an empty line and empty annotation collections,
+    returns them like draw_main, for callers that set the data of the line themselves
+    """
+    ax.clear()
+    line, = ax.plot([], [], color=MAIN_COLOR)
+    spans = ax.add_collection(PolyCollection([], animated=animated), autolim=False)
+    points = ax.add_collection(LineCollection(
+        [], transform=ax.get_xaxis_transform(), animated=animated), autolim=False)
+    ax.xaxis_date()
+    # adding grid
+    ax.grid(color='grey', linestyle='-', linewidth=0.25, alpha=0.5)
+    # removing top and right borders
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    return line, spans, points
+
+
+def draw_reference(ax, data):
+    """
+    draws the whole recording on the reference graph axes, returns the line
+    """
+    ax.clear()
+    line, = ax.plot(*envelope(data, 0, len(data), ax), color=REFERENCE_COLOR, linewidth=1)
+    ax.xaxis_date()
+    return line
+
+
+def draw_band_power(ax, bands):
+    """
+    prepares the band power graph axes with an empty line per band on a log scale, returns the lines
+    """
+    ax.clear()
+    lines = [ax.plot([], [], color=color, linewidth=1, label='{} {}-{} Hz'.format(name, low, high))[0]
+             for (name, low, high), color in zip(bands, BAND_COLORS)]
+    ax.set_yscale('log')
+    ax.xaxis_date()
+    ax.grid(color='grey', linestyle='-', linewidth=0.25, alpha=0.5)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.legend(loc='upper right', fontsize='small', framealpha=0.5)
+    return lines
+
+
+def annotation_shape(annotation, data):
+    """
+    returns how an annotation is drawn, as ('span', box vertices, color) covering the readings of a span annotation
+    or as ('point', vertical line in axes height, color) for a point annotation
+    """
+    annotation_color = tuple(map(lambda x: x / 256, annotation.color)) + (0.5,)
+    if annotation.start != annotation.end:
+        vmax, vmin = data.extrema(*data.span_range(annotation.start, annotation.end))
+        start, end = date2num(annotation.start), date2num(annotation.end)
+        return ('span', [(start, vmin - 10), (start, vmax + 10), (end, vmax + 10), (end, vmin - 10)], annotation_color)
+    x = date2num(annotation.start)
+    return ('point', [(x, 0), (x, 1)], annotation_color)
+
+
+def set_annotation_shapes(spans, points, shapes):
+    """
+    puts annotation shapes into one collection for spans and one for point lines
+    """
+    for kind, collection in (('span', spans), ('point', points)):
+        kind_shapes = [shape for shape in shapes if shape[0] == kind]
+        if kind == 'span':
+            collection.set_verts([shape[1] for shape in kind_shapes])
+        else:
+            collection.set_segments([shape[1] for shape in kind_shapes])
+        collection.set_color([shape[2] for shape in kind_shapes])
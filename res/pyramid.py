@@ -0,0 +1,214 @@
+import numpy as np
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MinMaxPyramid:
+    """
+    Multi-resolution min/max envelope of a Recording, built once per recording from the raw int16 readings.
+    Level k holds the min and max of every block of BLOCK * 2**k readings, so any window can be drawn
+    with a couple of points per pixel while still showing every spike.
+    """
+    BLOCK = 8
+    CHUNK = 1 << 20
+
+    def __init__(self, recording, arrays=None, workers=1, progress=None):
+        self.recording = recording
+        self.workers = workers
+        self.progress = progress
+        self.length = len(recording)
+        self.mins = []
+        self.maxs = []
+        # the arrays each level is a view on, see store
+        self.buffers = []
+        self.restored = arrays is not None and self.from_arrays(arrays)
+        if self.restored:
+            return
+        logging.info('Building min/max pyramid')
+        mins, maxs = self.build_base()
+        self.store_levels(0, mins, maxs)
+
+    def store_levels(self, first, mins, maxs):
+        """
+        writes the base blocks from index first onwards and recomputes every coarser block that depends on them
+        """
+        level = 0
+        while True:
+            self.store(level, first, mins, maxs)
+            if len(self.mins[level]) <= 1:
+                del self.mins[level + 1:], self.maxs[level + 1:], self.buffers[level + 1:]
+                break
+            first //= 2
+            mins = self.halve(self.mins[level][2 * first:], np.minimum)
+            maxs = self.halve(self.maxs[level][2 * first:], np.maximum)
+            level += 1
+
+    def store(self, level, first, mins, maxs):
+        """
+        writes blocks into a level from index first onwards, the level is a view on a buffer grown geometrically
+        so appending stays proportional to the new blocks
+        """
+        size = first + len(mins)
+        if level == len(self.mins):
+            self.mins.append(np.empty(0, dtype='<i2'))
+            self.maxs.append(np.empty(0, dtype='<i2'))
+            self.buffers.append([self.mins[level], self.maxs[level]])
+        for i, (levels, values) in enumerate(((self.mins, mins), (self.maxs, maxs))):
+            buffer = self.buffers[level][i]
+            if len(buffer) < size:
+                # the first build allocates exactly, later extensions leave room to grow
+                buffer = np.empty(max(size, 2 * len(buffer)) if first else size, dtype='<i2')
+                buffer[:first] = levels[level][:first]
+                self.buffers[level][i] = buffer
+            buffer[first:size] = values
+            levels[level] = buffer[:size]
+
+    def extend(self, start):
+        """
+        recomputes the blocks from reading index start onwards after readings were appended to the recording,
+        the cost is proportional to the readings after start
+        """
+        self.length = len(self.recording)
+        first = start // self.BLOCK
+        mins, maxs = self.reduce(self.recording.raw(first * self.BLOCK, self.length))
+        self.store_levels(first, mins, maxs)
+
+    def from_arrays(self, arrays):
+        """
+        restores the levels saved by to_arrays, returns False if they do not fit this recording
+        """
+        block = arrays.get('pyramid_block')
+        if block is None or int(block) != self.BLOCK:
+            return False
+        mins = [arrays['pyramid_min_{}'.format(level)] for level in range(int(arrays['pyramid_levels']))]
+        maxs = [arrays['pyramid_max_{}'.format(level)] for level in range(int(arrays['pyramid_levels']))]
+        if not mins or len(mins[0]) != -(-self.length // self.BLOCK):
+            return False
+        logging.info('Restored min/max pyramid')
+        self.mins = mins
+        self.maxs = maxs
+        self.buffers = [[level_mins, level_maxs] for level_mins, level_maxs in zip(mins, maxs)]
+        return True
+
+    def to_arrays(self):
+        """
+        returns the levels as a dict of named arrays, to be stored in a DecodeCache
+        """
+        arrays = {'pyramid_block': np.array(self.BLOCK), 'pyramid_levels': np.array(len(self.mins))}
+        for level in range(len(self.mins)):
+            arrays['pyramid_min_{}'.format(level)] = self.mins[level]
+            arrays['pyramid_max_{}'.format(level)] = self.maxs[level]
+        return arrays
+
+    def build_base(self):
+        """
+        computes the finest level by streaming over the recording in chunks of whole blocks,
+        chunks are reduced on up to workers threads and joined in order, counting the bytes read on progress
+        """
+        if self.length == 0:
+            return np.empty(0, dtype='<i2'), np.empty(0, dtype='<i2')
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            chunks = list(executor.map(self.reduce_chunk, range(0, self.length, self.CHUNK)))
+        return np.concatenate([mins for mins, maxs in chunks]), np.concatenate([maxs for mins, maxs in chunks])
+
+    def reduce_chunk(self, start):
+        """
+        returns the min and max of every block in the chunk starting at start
+        """
+        raw = self.recording.raw(start, start + self.CHUNK)
+        if self.progress is not None:
+            self.progress.add(bytes_read=raw.nbytes)
+        return self.reduce(raw)
+
+    def reduce(self, raw):
+        """
+        returns the min and max of every block of raw readings, the last block may be partial
+        """
+        full = len(raw) - len(raw) % self.BLOCK
+        blocks = raw[:full].reshape(-1, self.BLOCK)
+        mins = blocks.min(axis=1)
+        maxs = blocks.max(axis=1)
+        if full < len(raw):
+            mins = np.append(mins, raw[full:].min())
+            maxs = np.append(maxs, raw[full:].max())
+        return mins, maxs
+
+    @staticmethod
+    def halve(values, reduce):
+        """
+        merges neighbouring blocks pairwise, an odd last block is carried up as it is
+        """
+        pairs = len(values) // 2
+        merged = reduce(values[0:2 * pairs:2], values[1:2 * pairs:2])
+        if len(values) % 2:
+            merged = np.append(merged, values[-1])
+        return merged
+
+    def extrema(self, start, stop):
+        """
+        returns the raw (max, min) of the readings in [start, stop) in O(log n), by covering the range with
+        the largest whole blocks of each level and reading only the partial blocks at its ends
+        """
+        start = max(int(start), 0)
+        stop = min(int(stop), self.length)
+        if stop <= start:
+            raise ValueError("Cannot take the extrema of an empty range")
+        lo = -(-start // self.BLOCK)
+        hi = stop // self.BLOCK
+        if lo >= hi:
+            raw = self.recording.raw(start, stop)
+            return raw.max(), raw.min()
+        maxs = []
+        mins = []
+        for edge in (self.recording.raw(start, lo * self.BLOCK), self.recording.raw(hi * self.BLOCK, stop)):
+            if len(edge):
+                maxs.append(edge.max())
+                mins.append(edge.min())
+        level = 0
+        while lo < hi:
+            if lo % 2:
+                maxs.append(self.maxs[level][lo])
+                mins.append(self.mins[level][lo])
+                lo += 1
+            if hi % 2:
+                hi -= 1
+                maxs.append(self.maxs[level][hi])
+                mins.append(self.mins[level][hi])
+            lo //= 2
+            hi //= 2
+            level += 1
+        return max(maxs), min(mins)
+
+    def block_size(self, level):
+        return self.BLOCK << level
+
+    def level_for(self, samples_per_pixel):
+        """
+        returns the coarsest level with at least one block per pixel, or None when raw readings should be drawn
+        """
+        if samples_per_pixel <= self.BLOCK:
+            return None
+        level = int(np.log2(samples_per_pixel / self.BLOCK))
+        return min(level, len(self.mins) - 1)
+
+    def envelope(self, start, stop, width):
+        """
+        returns (indices, values) to draw the readings in [start, stop) on width pixels, the values are calibrated.
+        Zoomed out each block contributes its min and max at the block centre, zoomed in the raw readings are returned.
+        """
+        start = max(int(start), 0)
+        stop = min(int(np.ceil(stop)), self.length)
+        if stop <= start:
+            return np.empty(0), np.empty(0)
+        level = self.level_for((stop - start) / max(width, 1))
+        if level is None:
+            return np.arange(start, stop), self.recording.read(start, stop)
+        size = self.block_size(level)
+        first = start // size
+        last = -(-stop // size)
+        centres = np.minimum(np.arange(first, last) * size + size / 2, self.length - 1)
+        indices = np.repeat(centres, 2)
+        values = np.empty(2 * (last - first), dtype='<i2')
+        values[0::2] = self.mins[level][first:last]
+        values[1::2] = self.maxs[level][first:last]
+        return indices, self.recording.calibrate(values)
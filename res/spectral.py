@@ -0,0 +1,134 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+import threading
+import logging
+
+# frequency bands in Hz, up to the 25 Hz Nyquist frequency of readings 20 ms apart
+BANDS = (('delta', 0.5, 4), ('theta', 4, 8), ('alpha', 8, 13), ('beta', 13, 25))
+# readings per FFT window and between the starts of consecutive windows
+WINDOW = 256
+HOP = 128
+# lowest band power kept, below the quantisation noise of readings in tenths so only flat stretches reach it
+FLOOR = 1e-6
+
+
+class BandPower:
+    """
+    Power of each frequency band over time, from Hann windowed FFTs of WINDOW readings taken every HOP readings.
+    The recording is streamed through in chunks of CHUNK windows so memory stays fixed whatever its length,
+    and computing resumes where it stopped, so a cancelled or grown recording only needs its new windows.
+    """
+    CHUNK = 1024
+
+    def __init__(self, recording, window=WINDOW, hop=HOP, bands=BANDS, arrays=None):
+        self.recording = recording
+        self.window = window
+        self.hop = hop
+        self.bands = bands
+        timestamps = recording.timestamps
+        self.rate = 1e6 / timestamps.period_us if timestamps is not None else 50.0
+        frequencies = np.fft.rfftfreq(window, 1 / self.rate)
+        self.masks = np.array([(frequencies >= low) & (frequencies < high) for name, low, high in bands])
+        self.taper = np.hanning(window)
+        # one sided power spectral density summed over bins of rate / window Hz, band powers are in calibrated units squared
+        self.scale = 2 / (self.rate * (self.taper ** 2).sum()) * (self.rate / window)
+        self.power = np.empty((0, len(bands)))
+        # windows computed so far, the first done rows of power are valid
+        self.done = 0
+        # held while computing, windows sharing the recording wait for each other instead of computing twice
+        self.lock = threading.Lock()
+        if arrays is not None:
+            self.from_arrays(arrays)
+
+    @property
+    def name(self):
+        return 'band_power_{}_{}'.format(self.window, self.hop)
+
+    def frames(self):
+        """
+        returns the number of whole windows in the recording as it is now
+        """
+        return max((len(self.recording) - self.window) // self.hop + 1, 0)
+
+    def complete(self):
+        return self.done >= self.frames()
+
+    def compute(self, progress=None, changed=None):
+        """
+        computes the windows not done yet chunk by chunk and saves them to the decode cache of the recording,
+        the bytes read are counted on progress, which can cancel it. Other threads may read the done windows meanwhile.
+        changed is the first reading Recording.refresh replaced, the windows over it are computed again.
+        """
+        with self.lock:
+            if changed is not None:
+                # the first window reaching past changed
+                self.done = min(self.done, max((changed - self.window) // self.hop + 1, 0))
+            frames = self.frames()
+            if self.done >= frames:
+                return self.power[:self.done]
+            if len(self.power) < frames:
+                # the first computation allocates exactly, a recording still growing gets room to grow
+                power = np.empty((max(frames, 2 * len(self.power)) if self.done else frames, len(self.bands)))
+                power[:self.done] = self.power[:self.done]
+                self.power = power
+            logging.info('Computing band power of windows {} to {}'.format(self.done, frames))
+            while self.done < frames:
+                count = min(self.CHUNK, frames - self.done)
+                start = self.done * self.hop
+                readings = self.recording.read(start, start + (count - 1) * self.hop + self.window)
+                if progress is not None:
+                    progress.add(bytes_read=2 * len(readings))
+                self.power[self.done:self.done + count] = self.chunk(readings, count)
+                self.done += count
+            if self.recording.cache is not None:
+                self.recording.cache.update(self.to_arrays())
+            return self.power[:self.done]
+
+    def chunk(self, readings, count):
+        """
+        returns the band powers of count overlapping windows of readings, the windows are strided views of them
+        """
+        step = readings.strides[0]
+        windows = as_strided(readings, shape=(count, self.window), strides=(self.hop * step, step), writeable=False)
+        # the mean of each window is removed so the offset of the sensor does not leak into the lowest band
+        windows = (windows - windows.mean(axis=1, keepdims=True)) * self.taper
+        spectrum = np.abs(np.fft.rfft(windows, axis=1)) ** 2 * self.scale
+        return np.maximum(spectrum @ self.masks.T, FLOOR)
+
+    def centres(self, first=0, last=None):
+        """
+        returns the reading index at the centre of each window in [first, last) of the computed ones
+        """
+        last = self.done if last is None else min(last, self.done)
+        return np.arange(first, last) * self.hop + self.window / 2
+
+    def from_arrays(self, arrays):
+        """
+        restores the windows saved by to_arrays, as many as still fit the recording
+        """
+        power = arrays.get(self.name)
+        if power is None or power.ndim != 2 or power.shape[1] != len(self.bands):
+            return False
+        self.done = min(len(power), self.frames())
+        self.power = np.array(power[:self.done], dtype=float)
+        logging.info('Restored {} windows of band power'.format(self.done))
+        return True
+
+    def to_arrays(self):
+        """
+        returns the computed windows as a dict of named arrays, to be stored in a DecodeCache
+        """
+        return {self.name: self.power[:self.done]}
+
+
+def band_power(recording, window=WINDOW, hop=HOP):
+    """
+    returns the BandPower of recording for a window and hop, one per setting kept on the recording and restored
+    from its decode cache when there, its missing windows are computed by compute
+    """
+    key = (window, hop)
+    power = recording.spectra.get(key)
+    if power is None:
+        power = BandPower(recording, window, hop, arrays=None if recording.cache is None else recording.cache.load())
+        recording.spectra[key] = power
+    return power
@@ -4,11 +4,18 @@ from os.path import dirname
 sys.path.append(dirname(dirname(__file__)))
 sys.path.append(os.path.join(dirname(dirname(__file__)), 'res/'))
 from datetime import datetime
+from datetime import timedelta
 from annotations import decode_annotation
 from annotations import encode_annotation
 from annotations import open_json
 from annotations import save_json
 from annotations import Annotation
+from annotations import AnnotationStore
+from annotations import AnnotationJournal
+from annotations import AnnotationWriter
+import json
+import tempfile
+import shutil
 import unittest
 
 
@@ -62,6 +69,48 @@ class TestAnnotations(unittest.TestCase):
                          True, "This should be an annotation object")
         self.assertEqual(annotation, decoded_annotation)
 
+    def test_decode_whole_seconds(self):
+        annotation = Annotation("Whole", "", datetime(2008, 4, 2, 18, 0, 0), datetime(2008, 4, 2, 18, 0, 1), (256, 0, 0))
+        self.assertEqual(decode_annotation(encode_annotation(annotation)), annotation,
+                         "Should decode isoformat output without microseconds")
+
+    def test_decode_older_timebase(self):
+        def convert(time):
+            return time + timedelta(seconds=10)
+        annotation = self.annotations[0]
+        encoded = encode_annotation(annotation)
+        self.assertEqual(decode_annotation(encoded, convert), annotation, "Should keep times on the current timebase")
+        del encoded["timebase"]
+        moved = decode_annotation(encoded, convert)
+        self.assertEqual((moved.start, moved.end), (convert(annotation.start), convert(annotation.end)),
+                         "Should convert times saved on the older timebase")
+        self.assertEqual(decode_annotation(encoded), annotation, "Should keep times without a converter")
+
+    def test_journal_older_timebase(self):
+        def convert(time):
+            return time + timedelta(seconds=10)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "annotations.json")
+            with open(filename, "w") as outfile:
+                outfile.write(json.dumps([dict(encode_annotation(annotation), timebase=1)
+                                          for annotation in self.annotations[:2]]))
+            journal = AnnotationJournal(filename, convert)
+            loaded = journal.load()
+            self.assertEqual(loaded[0].start, convert(self.annotations[0].start))
+            journal.delete(loaded[0])
+            journal.compact()
+            self.assertEqual(open_json(filename), loaded[1:], "Should match and save annotations by converted times")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_open_json_without_color(self):
+        annotations = open_json("./data/recording2/pat2/annotations.json")
+        self.assertEqual(len(annotations), 1)
+        self.assertEqual(annotations[0].color, Annotation.DEFAULT_COLOR, "Should fall back to the default color")
+        with self.assertRaises(AttributeError):
+            annotations[0].extra = True
+
     def test_encode_exception(self):
         with self.assertRaises(TypeError):
             encode_annotation("Not an annotation")
@@ -83,6 +132,171 @@ class TestAnnotations(unittest.TestCase):
         with self.assertRaises(Exception):
             open_json("./data/invalid_json/annotations.json")
 
+    def test_annotation_store_lookup(self):
+        store = AnnotationStore(self.annotations)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(list(store), self.annotations, "Should keep the listbox order")
+        self.assertIs(store.get(self.annotations[2].id), self.annotations[2])
+        self.assertIs(store.at(1), self.annotations[1])
+        self.assertIs(store.remove(1), self.annotations[1])
+        self.assertIs(store.at(1), self.annotations[2], "Should shift the later positions")
+        with self.assertRaises(KeyError):
+            store.get(self.annotations[1].id)
+
+    def test_annotation_store_intervals(self):
+        store = AnnotationStore(self.annotations)
+        point = Annotation("Point", "", datetime.fromtimestamp(320.5), datetime.fromtimestamp(320.5), (256, 0, 0))
+        store.add(point)
+        self.assertEqual(store.overlapping(datetime.fromtimestamp(240), datetime.fromtimestamp(460)),
+                         [self.annotations[0], self.annotations[1], point, self.annotations[2]])
+        self.assertEqual(store.overlapping(datetime.fromtimestamp(320.5), datetime.fromtimestamp(320.5)),
+                         [self.annotations[1], point])
+        self.assertEqual(store.overlapping(datetime.fromtimestamp(550), datetime.fromtimestamp(560)), [])
+        store.remove(len(store) - 1)
+        self.assertEqual(store.overlapping(datetime.fromtimestamp(320.5), datetime.fromtimestamp(320.5)),
+                         [self.annotations[1]], "Should reindex after a change")
+
+    def test_journal_replay(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "annotations.json")
+            save_json(self.annotations[:2], filename)
+            journal = AnnotationJournal(filename)
+            journal.add(self.annotations[2])
+            journal.edit(self.annotations[0], "Edited", "New content")
+            journal.delete(self.annotations[1])
+            self.assertEqual(len(open_json(filename)), 2, "Should not rewrite the annotations file")
+            loaded = AnnotationJournal(filename).load()
+            self.assertEqual([a.title for a in loaded], ["Edited", "Test annotation 3"])
+            self.assertEqual(loaded[0].content, "New content")
+            # a crash mid-append leaves a torn line, which is skipped and ended by the next append
+            with open(journal.path, "a") as outfile:
+                outfile.write('{"op": "add", "annot')
+            journal = AnnotationJournal(filename)
+            self.assertEqual(len(journal.load()), 2)
+            journal.add(self.annotations[3])
+            self.assertEqual([a.title for a in AnnotationJournal(filename).load()],
+                             ["Edited", "Test annotation 3", "Test annotation 4"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_journal_replay_matches_list_order(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "annotations.json")
+            first, second = self.annotations[:2]
+            duplicate = Annotation(first.title, first.content, first.start, first.end, (0, 0, 256))
+            save_json([first, second, duplicate], filename)
+            journal = AnnotationJournal(filename)
+            # the first of two equal annotations is edited, then edited back and deleted, as list.index would do
+            journal.edit(first, "Edited", "Edited")
+            journal.edit(Annotation("Edited", "Edited", first.start, first.end, first.color),
+                         first.title, first.content)
+            journal.delete(first)
+            journal.edit(first, "Last", "Last")
+            journal.delete(Annotation("Missing", "", first.start, first.end, first.color))
+            loaded = AnnotationJournal(filename).load()
+            self.assertEqual([a.title for a in loaded], [second.title, "Last"])
+            self.assertEqual(list(loaded[1].color), [0, 0, 256], "Should have deleted the first of the equal annotations")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_journal_broken_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "annotations.json")
+            with open(filename, "w") as outfile:
+                outfile.write('[{"bad":1')
+            journal = AnnotationJournal(filename)
+            with self.assertRaises(Exception):
+                journal.load()
+            journal.add(self.annotations[0])
+            self.assertEqual(AnnotationJournal(filename).load(), self.annotations[:1],
+                             "Should save changes over no annotations")
+            with open(filename + AnnotationJournal.BAD_SUFFIX) as infile:
+                self.assertEqual(infile.read(), '[{"bad":1', "Should keep the broken file aside")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_journal_compaction(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "annotations.json")
+            journal = AnnotationJournal(filename)
+            journal.COMPACT_MIN = 3
+            for annotation in self.annotations:
+                journal.add(annotation)
+            self.assertEqual(open_json(filename), self.annotations[:3],
+                             "Should compact into the open_json format")
+            self.assertEqual(AnnotationJournal(filename).load(), self.annotations)
+            # a journal left over from before the file was replaced is ignored
+            with open(journal.path) as infile:
+                stale = infile.read()
+            save_json(self.annotations[:1], filename)
+            with open(journal.path, "w") as outfile:
+                outfile.write(stale)
+            self.assertEqual(AnnotationJournal(filename).load(), self.annotations[:1])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_writer_coalesces(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "annotations.json")
+            journal = AnnotationJournal(filename)
+            writes = []
+            write = journal.write
+            journal.write = lambda operations: writes.append(len(operations)) or write(operations)
+            writer = AnnotationWriter(journal)
+            writer.DELAY = 10
+            for annotation in self.annotations:
+                writer.add(annotation)
+            writer.edit(self.annotations[0], "Edited", "")
+            self.assertTrue(writer.close(), "Should write the burst on close")
+            self.assertEqual(writes, [5], "Should write the burst at once")
+            self.assertEqual([a.title for a in AnnotationJournal(filename).load()][:2], ["Edited", "Test annotation 2"])
+            with self.assertRaises(Exception):
+                writer.add(self.annotations[0])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_writer_errors(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "missing", "annotations.json")
+            writer = AnnotationWriter(AnnotationJournal(filename))
+            writer.add(self.annotations[0])
+            self.assertFalse(writer.flush(), "Should fail while the directory is missing")
+            self.assertFalse(writer.errors.empty(), "Should report the error")
+            os.mkdir(os.path.dirname(filename))
+            self.assertTrue(writer.close(), "Should write the failed operations again")
+            self.assertEqual(AnnotationJournal(filename).load(), self.annotations[:1])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_concurrent_writers(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "annotations.json")
+            save_json(self.annotations[:1], filename)
+            first = AnnotationWriter(AnnotationJournal(filename))
+            second = AnnotationWriter(AnnotationJournal(filename))
+            first.add(self.annotations[1])
+            first.flush()
+            # the second window compacts without knowing the first window's annotation
+            second.add(self.annotations[2])
+            second.add(self.annotations[3])
+            second.flush()
+            with second.journal.locked():
+                second.journal.compact()
+            self.assertEqual(open_json(filename), self.annotations)
+            first.delete(self.annotations[0])
+            self.assertTrue(first.close() and second.close())
+            self.assertEqual(AnnotationJournal(filename).load(), self.annotations[1:],
+                             "Should keep the changes of both windows")
+        finally:
+            shutil.rmtree(directory)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,71 @@
+import sys
+import os
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+sys.path.append(os.path.join(dirname(dirname(__file__)), 'res/'))
+import numpy as np
+import shutil
+import tempfile
+from cache import DecodeCache
+from data import open_project
+import unittest
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "pat1") + "/"
+        shutil.copytree("./data/recording1/pat1", self.path)
+
+    def tearDown(self):
+        DecodeCache.directory = None
+        shutil.rmtree(self.directory)
+
+    def test_reopen_uses_cache(self):
+        data, timestamps, annotations = open_project(self.path)
+        pyramid = data.pyramid
+        self.assertFalse(pyramid.restored, "Should be built on the first open")
+        self.assertTrue(os.path.exists(self.path + DecodeCache.FILENAME), "Should write the cache next to the project")
+
+        cached_data, cached_timestamps, annotations = open_project(self.path)
+        self.assertTrue(cached_data.pyramid.restored, "Should be restored on the second open")
+        self.assertEqual(cached_timestamps.start, timestamps.start)
+        self.assertEqual(cached_timestamps.period, timestamps.period)
+        for level in range(len(pyramid.mins)):
+            self.assertTrue(np.array_equal(cached_data.pyramid.mins[level], pyramid.mins[level]))
+            self.assertTrue(np.array_equal(cached_data.pyramid.maxs[level], pyramid.maxs[level]))
+
+    def test_changed_file_invalidates_cache(self):
+        data, timestamps, annotations = open_project(self.path)
+        data.pyramid
+        wav = [f for f in os.listdir(self.path) if f.endswith('.wav')][0]
+        with open(self.path + wav, 'ab') as outfile:
+            outfile.write(b'\x01\x00')
+        data, timestamps, annotations = open_project(self.path)
+        self.assertFalse(data.pyramid.restored, "Should rebuild after a segment changed")
+        self.assertEqual(len(data.pyramid.mins[0]), -(-len(data) // 8))
+
+    def test_changed_file_not_written(self):
+        data, timestamps, annotations = open_project(self.path)
+        data.pyramid
+        mtime = os.stat(self.path + DecodeCache.FILENAME).st_mtime_ns
+        wav = [f for f in os.listdir(self.path) if f.endswith('.wav')][0]
+        with open(self.path + wav, 'ab') as outfile:
+            outfile.write(b'\x01\x00')
+        data.cache.update({'extra': np.arange(3)})
+        self.assertEqual(os.stat(self.path + DecodeCache.FILENAME).st_mtime_ns, mtime,
+                         "Should not rewrite a cache whose files changed")
+
+    def test_cache_directory(self):
+        DecodeCache.directory = os.path.join(self.directory, "cache")
+        data, timestamps, annotations = open_project(self.path)
+        data.pyramid
+        self.assertFalse(os.path.exists(self.path + DecodeCache.FILENAME), "Should not write next to the project")
+        self.assertEqual(len(os.listdir(DecodeCache.directory)), 1, "Should write into the cache directory")
+        data, timestamps, annotations = open_project(self.path)
+        self.assertTrue(data.pyramid.restored)
+
+
+if __name__ == '__main__':
+    unittest.main()
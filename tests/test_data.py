@@ -5,8 +5,22 @@ sys.path.append(dirname(dirname(__file__)))
 sys.path.append(os.path.join(dirname(dirname(__file__)), 'res/'))
 import numpy as np
 import datetime
+import glob
+import json
+import shutil
+import struct
+import tempfile
 from data import check_valid_path
 from data import open_project
+from data import read_wav
+from data import Recording
+from data import LoadProgress
+from data import LoadCancelled
+from data import Timebase
+from data import get_checkpoints
+from data import RecordingCache
+from cache import DecodeCache
+from annotations import AnnotationJournal
 import unittest
 
 
@@ -14,12 +28,19 @@ import unittest
 class Test_Data(unittest.TestCase):
 
     def setUp(self):
+        # decode caches go to a directory of their own, not into the fixtures
+        self.cache_directory = tempfile.mkdtemp()
+        DecodeCache.directory = self.cache_directory
         self.path = "./data/recording2/pat2/"
         data, timestamps, annotations = open_project(self.path)
         self.data = data
         self.timestamps = timestamps
         self.annotations = annotations
 
+    def tearDown(self):
+        DecodeCache.directory = None
+        shutil.rmtree(self.cache_directory)
+
     def test_check_valid_path(self):
         self.assertTrue(
             check_valid_path(
@@ -49,7 +70,7 @@ class Test_Data(unittest.TestCase):
             "Should be: 2008-04-02 16:24:49")
 
     def test_timestamps_correctness(self):
-        for i in range(1, len(self.timestamps)):
+        for i in (1, 1000, len(self.timestamps) - 1):
             previous_timestamp = self.timestamps[i - 1]
             current_timestamp = self.timestamps[i]
             self.assertTrue(
@@ -57,8 +78,71 @@ class Test_Data(unittest.TestCase):
                     current_timestamp,
                     datetime.datetime),
                 "Should be a timestamp")
-            self.assertEqual(current_timestamp - datetime.timedelta(microseconds=1000 * 20), previous_timestamp,
-                             "Should be the same")
+            self.assertAlmostEqual((current_timestamp - previous_timestamp).total_seconds(), 0.02, delta=0.0005,
+                                   msg="Should be about 20ms apart")
+        timestamps = self.timestamps[:]
+        self.assertEqual(len(timestamps), len(self.data), "Should have a timestamp per reading")
+        self.assertEqual(timestamps[0], np.datetime64(self.timestamps[0]), "Should be the same")
+        self.assertTrue(np.all(np.diff(timestamps) > np.timedelta64(19, 'ms')), "Should be increasing")
+
+    def test_timebase_checkpoints(self):
+        initial_time, checkpoints = get_checkpoints(self.path + "04-02-2008_16_24_43_0000_000000.cal")
+        self.assertEqual(len(checkpoints), 247, "Should read every line of the .cal file")
+        self.assertEqual(checkpoints[1], 339 * 1000000, "Should be 16:30:28")
+        self.assertEqual(initial_time + datetime.timedelta(microseconds=int(checkpoints[-1])),
+                         datetime.datetime(2008, 4, 3, 15, 29, 30), "Should wrap past midnight")
+        step = self.timestamps.step
+        for k in (1, 2, 100):
+            self.assertEqual(self.timestamps[k * step],
+                             initial_time + datetime.timedelta(microseconds=int(checkpoints[k])),
+                             "Should be at the checkpoint time")
+        indices = np.array([0, 10.5, step, 3.5 * step, len(self.timestamps) - 1])
+        self.assertTrue(np.allclose(self.timestamps.indices_of_nums(self.timestamps.nums(indices)), indices),
+                        "Should convert back and forth")
+        reopened = Timebase.from_array(self.timestamps.to_array(), len(self.timestamps))
+        self.assertEqual(reopened.time_of(123456), self.timestamps.time_of(123456), "Should survive the cache")
+
+    def test_checkpoints_clock_stepped_back(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "26-10-2008_01_44_20_0000_000000.cal")
+            with open(filename, 'w') as outfile:
+                outfile.write("26-10-2008 01:44:20 --> Data Collection Started\n"
+                              "26-10-2008\t01:50:00\n26-10-2008\t01:55:38\n26-10-2008\t01:01:16\n"
+                              "26-10-2008\t23:59:59\n27-10-2008\t00:05:38\n")
+            initial_time, checkpoints = get_checkpoints(filename)
+            self.assertEqual(list(checkpoints // 1000000), [0, 340, 678, -2584, 80139, 80478],
+                             "Should take the date of every line instead of guessing midnight wraps")
+            timestamps = Timebase(initial_time, 40000, checkpoints=checkpoints, step=16900)
+            self.assertLess(timestamps.time_of(33800), datetime.datetime(2008, 10, 26, 2, 0),
+                            "Should leave out the checkpoint after the clock stepped back")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_annotations_moved_onto_timebase(self):
+        # the fixture annotation was saved on the uniform 20 ms timebase, it stays on the same readings
+        with open(self.path + "annotations.json") as infile:
+            saved = json.load(infile)[0]
+        annotation = self.annotations[0]
+        for key, time in (("start_time", annotation.start), ("end_time", annotation.end)):
+            index = (datetime.datetime.fromisoformat(saved[key]) - self.timestamps.start) / datetime.timedelta(milliseconds=20)
+            self.assertAlmostEqual(self.timestamps.indices_of((time - self.timestamps.start) / Timebase.US), index, places=3)
+
+    def test_timebase_searchsorted(self):
+        timestamps = self.timestamps[:]
+        step = self.timestamps.step
+        for time in (self.timestamps[0] - datetime.timedelta(seconds=1), self.timestamps[10],
+                     self.timestamps[10] + datetime.timedelta(milliseconds=7), self.timestamps[4999],
+                     self.timestamps[step], self.timestamps[step] - datetime.timedelta(microseconds=1),
+                     self.timestamps[5 * step + 77] + datetime.timedelta(milliseconds=3), self.timestamps.end):
+            for side in ('left', 'right'):
+                self.assertEqual(self.timestamps.searchsorted(time, side=side),
+                                 np.searchsorted(timestamps, np.datetime64(time), side=side),
+                                 "Should match np.searchsorted")
+        self.assertEqual(self.timestamps.searchsorted(self.timestamps.end, side='right'), len(self.timestamps))
+        self.assertEqual(self.timestamps.index_of(
+            self.timestamps[10] + datetime.timedelta(milliseconds=7)), 10)
+        self.assertEqual(self.timestamps.time_of(10), self.timestamps[10])
 
     def test_read_wav(self):
         self.assertTrue(
@@ -67,6 +151,186 @@ class Test_Data(unittest.TestCase):
                 np.integer),
             "Should be an array of integers")
 
+    def test_read_wav_matches_per_sample_decode(self):
+        for filename in sorted(glob.glob(self.path + "*.wav")):
+            with open(filename, 'rb') as infile:
+                raw_data = infile.read()
+            expected = [struct.unpack('<h', raw_data[i:i + 2])[0]
+                        for i in range(0, len(raw_data) - 1, 2)]
+            frames = read_wav(filename)
+            self.assertEqual(frames.dtype, np.dtype('<i2'),
+                             "Should be little-endian int16")
+            self.assertTrue(np.array_equal(frames, expected),
+                            "Should match the per-sample decode")
+
+    def test_read_wav_trailing_odd_byte(self):
+        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as outfile:
+            outfile.write(struct.pack('<3h', 1, -2, 300) + b'\x07')
+        try:
+            self.assertEqual(list(read_wav(outfile.name)), [1, -2, 300, 300],
+                             "The last reading should be repeated")
+        finally:
+            os.remove(outfile.name)
+
+    def test_recording_matches_stacked_segments(self):
+        stacked = np.hstack([read_wav(filename) for filename in sorted(
+            glob.glob(self.path + "*.wav"))]) / 10
+        self.assertIsInstance(self.data, Recording)
+        self.assertEqual(len(self.data), len(stacked), "Should have every reading")
+        self.assertTrue(np.array_equal(np.asarray(self.data), stacked),
+                        "Should be the same readings")
+        # slices crossing a segment boundary
+        boundary = len(read_wav(sorted(glob.glob(self.path + "*.wav"))[0]))
+        for key in (slice(boundary - 5, boundary + 5), slice(10, 2000000, 997),
+                    slice(None, None, -1000), slice(-3, None)):
+            self.assertTrue(np.array_equal(self.data[key], stacked[key]),
+                            "Slice {} should match".format(key))
+        for key in ([0, -1], [boundary, 3, boundary - 1, 3], np.arange(0, len(stacked), 1000), []):
+            self.assertTrue(np.array_equal(self.data[key], stacked[key]), "Indices {} should match".format(key))
+        mask = np.zeros(len(stacked), dtype=bool)
+        mask[[5, boundary + 5]] = True
+        self.assertTrue(np.array_equal(self.data[mask], stacked[mask]))
+        with self.assertRaises(IndexError):
+            self.data[0, 1]
+        with self.assertRaises(IndexError):
+            self.data[[0, len(stacked)]]
+        self.assertEqual(self.data[boundary], stacked[boundary])
+        self.assertEqual(self.data[-1], stacked[-1])
+        with self.assertRaises(IndexError):
+            self.data[len(stacked)]
+
+    def test_recording_keeps_raw_readings(self):
+        raw = self.data.raw(999990, 1000010)
+        self.assertEqual(raw.dtype, np.dtype('<i2'), "Should stay int16")
+        self.assertTrue(np.array_equal(raw / 10, self.data[999990:1000010]),
+                        "Calibrated readings should be the raw readings / 10")
+        vmax, vmin = self.data.extrema(5000, 90000)
+        self.assertEqual(vmax, self.data[5000:90000].max())
+        self.assertEqual(vmin, self.data[5000:90000].min())
+
+    def test_open_project_workers(self):
+        serial, timestamps, annotations = open_project(self.path, workers=1)
+        self.assertTrue(np.array_equal(np.asarray(serial), np.asarray(self.data)),
+                        "Should join the segments in the same order")
+
+    def test_open_project_failing_segment(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "pat2") + "/"
+            shutil.copytree(self.path, path)
+            for filename in ("04-02-2008_16_24_43_2_000000.wav", "04-02-2008_16_24_43_4_000000.wav"):
+                open(path + filename, 'wb').close()
+            with self.assertRaisesRegex(Exception, "^One of the data files could not be read$"):
+                open_project(path, workers=4)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_open_project_progress(self):
+        progress = LoadProgress()
+        data, timestamps, annotations = open_project(self.path, progress=progress)
+        self.assertEqual(progress.segments, 6, "Should count every mapped segment")
+        self.assertEqual(progress.total_segments, 6)
+        self.assertEqual(progress.total_bytes, sum(os.path.getsize(f) for f in glob.glob(self.path + "*.wav")))
+        data.cache = None
+        data.build_pyramid(progress)
+        self.assertEqual(progress.bytes_read, 2 * len(data), "Should count every byte read")
+
+    def test_open_project_cancelled(self):
+        progress = LoadProgress()
+        progress.cancel()
+        with self.assertRaises(LoadCancelled):
+            open_project(self.path, progress=progress)
+
+    def test_open_project_after_recovery(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "pat2") + "/"
+            shutil.copytree(self.path, path)
+            with open(path + "annotations.json", "w") as outfile:
+                outfile.write('[{"bad":1')
+            annotation = self.annotations[0]
+            AnnotationJournal(path + "annotations.json").add(annotation)
+            self.assertTrue(os.path.exists(path + "annotations.json" + AnnotationJournal.BAD_SUFFIX))
+            data, timestamps, annotations = open_project(path)
+            self.assertEqual(annotations, [annotation], "Should read the saved annotations, not the broken file")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_recording_refresh(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "pat2") + "/"
+            shutil.copytree(self.path, path)
+            data, timestamps, annotations = open_project(path)
+            length = len(data)
+            self.assertIsNone(data.refresh(), "Should not change without new readings")
+            with open(path + "04-02-2008_16_24_43_5_000000.wav", 'ab') as outfile:
+                outfile.write(struct.pack('<2h', 11, 12) + b'\x00')
+            self.assertEqual(data.refresh(), length, "Should report the first new reading")
+            self.assertEqual(list(data.raw(length, len(data))), [11, 12, 12])
+            with open(path + "04-02-2008_16_24_43_5_000000.wav", 'ab') as outfile:
+                outfile.write(b'\x01')
+            for segment in (10, 6):
+                with open(path + "04-02-2008_16_24_43_{}_000000.wav".format(segment), 'wb') as outfile:
+                    outfile.write(struct.pack('<2h', segment, -segment))
+            self.assertEqual(data.refresh(), length + 2, "Should report the repeated reading as changed")
+            self.assertEqual(list(data.raw(length, len(data))), [11, 12, 256, 6, -6, 10, -10],
+                             "Should replace the repeated reading and append segments in order")
+            self.assertEqual(len(timestamps), len(data), "Should extend the timestamps")
+            reopened, timestamps, annotations = open_project(path)
+            self.assertTrue(np.array_equal(np.asarray(reopened), np.asarray(data)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_recording_span_range(self):
+        first, last = self.data.span_range(self.timestamps[1000], self.timestamps[1001])
+        self.assertEqual((first, last), (1000, 1002), "Should include the readings a span is snapped to")
+        self.data.extrema(first, last)
+        start = self.timestamps[1000] + datetime.timedelta(milliseconds=5)
+        self.assertEqual(self.data.span_range(start, start + datetime.timedelta(milliseconds=5)), (1001, 1002),
+                         "Should not be empty between two readings")
+        end = self.timestamps[len(self.timestamps) - 1] + datetime.timedelta(seconds=10)
+        self.assertEqual(self.data.span_range(end, end), (len(self.data) - 1, len(self.data)))
+
+    def test_recording_time_slice(self):
+        start, end = self.timestamps[1000], self.timestamps[1010]
+        self.assertTrue(np.array_equal(self.data.time_slice(start, end), self.data[1001:1010]),
+                        "Should only contain readings strictly between start and end")
+
+    def test_recording_cache_shares(self):
+        cache = RecordingCache()
+        first = object()
+        second = object()
+        data, timestamps, annotations = cache.open(self.path, first)
+        shared, shared_timestamps, shared_annotations = cache.open(self.path, second)
+        self.assertIs(shared, data, "Should share the recording of an unchanged project")
+        self.assertIs(shared_timestamps, timestamps)
+        self.assertEqual(len(shared_annotations), len(annotations), "Should read the annotations again")
+        self.assertIsNot(shared_annotations, annotations)
+        self.assertIsNotNone(data._pyramid, "Should build the pyramid before sharing")
+        cache.release(first)
+        cache.release(second, shared)
+        self.assertIs(cache.open(self.path, first)[0], data, "Should keep a released recording within budget")
+
+    def test_recording_cache_budget(self):
+        cache = RecordingCache(budget=0)
+        owner = object()
+        data = cache.open(self.path, owner)[0]
+        other = cache.open('./data/recording1/pat1/', owner)[0]
+        self.assertEqual(len(cache.entries), 2, "Should not evict recordings in use")
+        cache.release(owner, data)
+        self.assertEqual([entry[0] for entry in cache.entries.values()], [other],
+                         "Should evict unused recordings over budget")
+        self.assertIsNot(cache.open(self.path, owner)[0], data, "Should open an evicted project again")
+
+    def test_recording_cache_cancelled(self):
+        cache = RecordingCache()
+        progress = LoadProgress()
+        progress.cancel()
+        with self.assertRaises(LoadCancelled):
+            cache.open(self.path, object(), progress=progress)
+        self.assertEqual(len(cache.entries), 0, "Should not keep a cancelled load")
+
 
 if __name__ == '__main__':
     unittest.main()
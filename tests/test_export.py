@@ -0,0 +1,64 @@
+import sys
+import os
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+sys.path.append(os.path.join(dirname(dirname(__file__)), 'res/'))
+from export import export_project, export_projects, export_pages, open_for_export
+import tempfile
+import shutil
+import unittest
+from cache import DecodeCache
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        # decode caches go to a directory of their own, not into the fixtures, also in the export processes
+        self.cache_directory = tempfile.mkdtemp()
+        DecodeCache.directory = os.environ['BRAINWAVE_CACHE_DIR'] = self.cache_directory
+
+    def tearDown(self):
+        DecodeCache.directory = None
+        del os.environ['BRAINWAVE_CACHE_DIR']
+        shutil.rmtree(self.output)
+        shutil.rmtree(self.cache_directory)
+
+    def test_export_project(self):
+        files = export_project("./data/recording2/pat2/", self.output)
+        self.assertEqual([os.path.basename(file) for file in files],
+                         ["pat2.pdf", "pat2_main.png", "pat2_reference.png"])
+        for file in files:
+            self.assertGreater(os.path.getsize(file), 0, "Should have written {}".format(file))
+
+    def test_export_pages(self):
+        recording, annotations = open_for_export("./data/recording2/pat2/")
+        filename = os.path.join(self.output, "pages.pdf")
+        duration = (recording.timestamps.end - recording.timestamps.start).total_seconds()
+        pages = export_pages(recording, annotations, filename, 3600, rows=4)
+        self.assertEqual(pages, -(-int(-(-duration // 3600)) // 4), "Should fit four hours on each page")
+        with open(filename, "rb") as infile:
+            self.assertIn("/Count {}".format(pages).encode(), infile.read(), "Should write one pdf page each")
+
+    def test_export_pages_last_reading(self):
+        recording, annotations = open_for_export("./data/recording2/pat2/")
+        duration = (recording.timestamps.end - recording.timestamps.start).total_seconds()
+        ranges = []
+        envelope = recording.pyramid.envelope
+        recording.pyramid.envelope = lambda first, last, width: ranges.append((first, last)) or envelope(first, last, width)
+        export_pages(recording, annotations, os.path.join(self.output, "pages.pdf"), duration / 2, rows=4)
+        self.assertEqual(ranges, [(0, ranges[1][0]), (ranges[1][0], len(recording))],
+                         "Should draw every reading once when the strips end at the last one")
+
+    def test_export_projects(self):
+        paths = ["./data/recording1/pat1", "./data/invalid_paths/no_cal_file"]
+        results = list(export_projects(paths, self.output, formats=('pdf',), workers=2))
+        self.assertEqual([path for path, files, error in results], paths, "Should keep the order of the projects")
+        self.assertEqual(results[0][1], [os.path.join(self.output, "pat1.pdf")])
+        self.assertIsNone(results[0][2])
+        self.assertEqual(results[1][1], [])
+        self.assertIsNotNone(results[1][2], "Should report the invalid project")
+
+
+if __name__ == '__main__':
+    unittest.main()
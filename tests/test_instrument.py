@@ -0,0 +1,66 @@
+import sys
+import os
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+sys.path.append(os.path.join(dirname(dirname(__file__)), 'res/'))
+import instrument  # noqa: E402
+import data  # noqa: E402
+import tempfile  # noqa: E402
+import shutil  # noqa: E402
+import json  # noqa: E402
+import unittest  # noqa: E402
+from cache import DecodeCache  # noqa: E402
+
+
+class TestInstrument(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        # decode caches go to the output directory, not into the fixtures
+        DecodeCache.directory = self.output
+
+    def tearDown(self):
+        instrument.stop()
+        DecodeCache.directory = None
+        shutil.rmtree(self.output)
+
+    def test_spans_nest(self):
+        filename = os.path.join(self.output, 'trace.jsonl')
+        instrument.start(filename)
+        with instrument.span('outer', path='x'):
+            with instrument.span('inner') as span:
+                span.count(10)
+        instrument.stop()
+        with open(filename) as infile:
+            inner, outer = [json.loads(line) for line in infile]
+        self.assertEqual(inner['name'], 'inner')
+        self.assertEqual(inner['parent'], 'outer')
+        self.assertEqual(inner['depth'], 1)
+        self.assertEqual(inner['bytes'], 10)
+        self.assertEqual(outer['parent'], None)
+        self.assertEqual(outer['path'], 'x')
+        self.assertGreaterEqual(outer['duration'], inner['duration'])
+
+    def test_chrome_trace(self):
+        filename = os.path.join(self.output, 'trace.json')
+        instrument.start(filename)
+        data.open_project('./data/recording2/pat2/')
+        instrument.stop()
+        with open(filename) as infile:
+            events = json.load(infile)
+        names = {event['name'] for event in events}
+        self.assertTrue({'open_project', 'scan_directory', 'map_segments', 'load_annotations'} <= names)
+        self.assertTrue(all(event['ph'] == 'X' and event['dur'] >= 0 for event in events))
+
+    def test_resident_bytes(self):
+        self.assertGreater(instrument.resident_bytes(), 0, "Should read resident memory with or without psutil")
+
+    def test_disabled(self):
+        self.assertFalse(instrument.enabled())
+        with instrument.span('ignored') as span:
+            span.count(10)
+        self.assertIs(span, instrument.NULL_SPAN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import sys
+import os
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+sys.path.append(os.path.join(dirname(dirname(__file__)), 'res/'))
+import numpy as np
+from data import Recording
+from pyramid import MinMaxPyramid
+import unittest
+
+
+class TestPyramid(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.raw = rng.randint(-300, 300, size=100003).astype('<i2')
+        # a single sample spike that must survive any decimation
+        self.raw[54321] = 30000
+        self.recording = Recording([[self.raw[:40000]], [self.raw[40000:]]])
+        self.pyramid = MinMaxPyramid(self.recording)
+
+    def test_levels(self):
+        self.assertEqual(len(self.pyramid.mins[0]), int(np.ceil(len(self.raw) / 8)),
+                         "Should have one entry per block of 8 readings")
+        self.assertEqual(len(self.pyramid.mins[-1]), 1, "Should end with a single block")
+        for level in range(len(self.pyramid.mins)):
+            size = self.pyramid.block_size(level)
+            for block in (0, len(self.pyramid.mins[level]) - 1):
+                values = self.raw[block * size:(block + 1) * size]
+                self.assertEqual(self.pyramid.mins[level][block], values.min())
+                self.assertEqual(self.pyramid.maxs[level][block], values.max())
+
+    def test_envelope_keeps_spikes(self):
+        indices, values = self.pyramid.envelope(0, len(self.raw), 500)
+        self.assertLessEqual(len(values), 4 * 500, "Should draw a few points per pixel")
+        self.assertEqual(values.max(), 3000, "Should keep the spike")
+        self.assertEqual(values.min(), self.raw.min() / 10)
+        indices, values = self.pyramid.envelope(50000, 60000, 100)
+        self.assertEqual(values.max(), 3000, "Should keep the spike when zoomed in")
+
+    def test_envelope_raw_when_zoomed_in(self):
+        indices, values = self.pyramid.envelope(39990, 40010, 500)
+        self.assertTrue(np.array_equal(indices, np.arange(39990, 40010)))
+        self.assertTrue(np.array_equal(values, self.raw[39990:40010] / 10),
+                        "Should be the calibrated raw readings")
+
+    def test_extrema(self):
+        rng = np.random.RandomState(1)
+        ranges = [(0, len(self.raw)), (54321, 54322), (3, 5), (7, 17), (40000, 100003), (99999, 100003)]
+        ranges += [tuple(sorted(rng.randint(0, len(self.raw) + 1, size=2))) for i in range(200)]
+        for start, stop in ranges:
+            if start == stop:
+                with self.assertRaises(ValueError):
+                    self.pyramid.extrema(start, stop)
+                continue
+            self.assertEqual(self.pyramid.extrema(start, stop),
+                             (self.raw[start:stop].max(), self.raw[start:stop].min()),
+                             "Should match a scan of [{}, {})".format(start, stop))
+
+    def test_extend(self):
+        recording = Recording([[self.raw[:40000]]])
+        pyramid = MinMaxPyramid(recording)
+        recording.segments.append([self.raw[40000:]])
+        recording.join()
+        pyramid.extend(39999)
+        for level in range(len(self.pyramid.mins)):
+            self.assertTrue(np.array_equal(pyramid.mins[level], self.pyramid.mins[level]),
+                            "Should match a pyramid built from scratch")
+            self.assertTrue(np.array_equal(pyramid.maxs[level], self.pyramid.maxs[level]))
+        self.assertEqual(len(pyramid.mins), len(self.pyramid.mins))
+
+
+if __name__ == '__main__':
+    unittest.main()
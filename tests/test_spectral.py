@@ -0,0 +1,91 @@
+import sys
+import os
+from os.path import dirname
+sys.path.append(dirname(dirname(__file__)))
+sys.path.append(os.path.join(dirname(dirname(__file__)), 'res/'))
+import numpy as np
+from data import Recording, LoadProgress, LoadCancelled
+from spectral import BandPower, band_power, BANDS
+import unittest
+
+
+class TestSpectral(unittest.TestCase):
+
+    def setUp(self):
+        # 10 Hz for the first half, 2 Hz for the second, at 50 readings per second in tenths of a unit
+        t = np.arange(60000) / 50
+        signal = np.where(t < 600, np.sin(2 * np.pi * 10 * t), np.sin(2 * np.pi * 2 * t))
+        self.raw = (1000 * signal + 500).astype('<i2')
+        self.recording = Recording([[self.raw[:25000]], [self.raw[25000:]]])
+
+    def test_bands(self):
+        power = BandPower(self.recording)
+        values = power.compute()
+        self.assertEqual(len(values), (60000 - 256) // 128 + 1, "Should have one row per whole window")
+        names = [name for name, low, high in BANDS]
+        centres = power.centres()
+        first = values[centres < 29000]
+        second = values[centres > 31000]
+        self.assertTrue(np.all(first.argmax(axis=1) == names.index('alpha')))
+        self.assertTrue(np.all(second.argmax(axis=1) == names.index('delta')))
+        # a sine of amplitude 100 has a power of 100 ** 2 / 2
+        self.assertAlmostEqual(first[:, names.index('alpha')].mean(), 5000, delta=250)
+
+    def test_chunks(self):
+        whole = BandPower(self.recording).compute()
+        power = BandPower(self.recording)
+        power.CHUNK = 7
+        self.assertTrue(np.allclose(power.compute(), whole), "Should not depend on the chunk size")
+        window = self.raw[128 * 5:128 * 5 + 256] / 10
+        window = (window - window.mean()) * np.hanning(256)
+        spectrum = np.abs(np.fft.rfft(window)) ** 2 * power.scale
+        self.assertAlmostEqual(spectrum[power.masks[2]].sum(), whole[5, 2])
+
+    def test_resume(self):
+        progress = LoadProgress()
+        power = BandPower(self.recording)
+        power.CHUNK = 10
+        calls = []
+
+        def add(**counts):
+            calls.append(counts)
+            if len(calls) == 3:
+                progress.cancel()
+            progress.check()
+        progress.add = add
+        with self.assertRaises(LoadCancelled):
+            power.compute(progress)
+        self.assertEqual(power.done, 20, "Should keep the chunks computed before cancelling")
+        self.assertFalse(power.complete())
+        self.assertTrue(np.allclose(power.compute(), BandPower(self.recording).compute()))
+        restored = BandPower(self.recording, arrays=power.to_arrays())
+        self.assertTrue(restored.complete(), "Should restore computed windows")
+
+    def test_grow(self):
+        power = BandPower(Recording([[self.raw[:30000]]]))
+        power.compute()
+        power.recording = self.recording
+        self.assertTrue(np.allclose(power.compute(), BandPower(self.recording).compute()),
+                        "Should only compute the windows of the new readings")
+        self.assertGreaterEqual(len(power.power), 2 * 233, "Should leave room to grow")
+
+    def test_changed_readings(self):
+        raw = self.raw.copy()
+        raw[30000:30010] = 0
+        power = BandPower(Recording([[raw]]))
+        power.compute()
+        power.recording = self.recording
+        self.assertTrue(np.allclose(power.compute(changed=30000), BandPower(self.recording).compute()),
+                        "Should compute the windows over the changed readings again")
+
+    def test_band_power_cached(self):
+        power = band_power(self.recording)
+        power.compute()
+        self.assertIs(band_power(self.recording), power, "Should compute each setting once")
+        self.assertTrue(band_power(self.recording).complete())
+        self.assertIsNot(band_power(self.recording, 512, 256), power)
+        self.assertEqual(len(self.recording.spectra), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
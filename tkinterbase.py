@@ -1,26 +1,47 @@
 from tkinter import Label, Button, Toplevel, Entry, filedialog, PhotoImage, ttk, colorchooser, Scrollbar
 import tkinter
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib.widgets import SpanSelector
-from matplotlib.dates import date2num
-import itertools
+from matplotlib.patches import Rectangle
+from matplotlib.backend_bases import MouseButton
+import contextlib
 import datetime
-import numpy as np
-from annotations import Annotation, save_json
+import os
+import queue
+import threading
+from annotations import Annotation, AnnotationStore, AnnotationJournal, AnnotationWriter
 import data
+import plotting
+import spectral
+import instrument
 from tkinter import messagebox
 import logging
 
 
 class TkBase:
-    id_generator = itertools.count(1)
+    # milliseconds the main graph x-range has to settle before the line is re-rendered
+    RENDER_DELAY = 40
+    # fraction of the visible x-range rendered on either side so small pans need no re-render
+    RENDER_MARGIN = 0.5
+    # milliseconds between checks on a project loading in the background
+    LOAD_POLL = 100
+    # milliseconds between checks for new readings in follow mode
+    FOLLOW_POLL = 1000
+    # milliseconds between checks for annotation write errors, and seconds to wait for pending writes on close
+    WRITE_POLL = 500
+    WRITE_TIMEOUT = 10
+    # milliseconds between redraws of the band power graph while it is computed in the background
+    SPECTRUM_POLL = 250
+    # readings per FFT window offered for the band power graph, windows overlap by half
+    SPECTRUM_WINDOWS = (128, 256, 512)
+    # chrome trace written while timings are recorded, next to event_log.log
+    TRACE_FILE = 'brainwave_trace.json'
 
     def __init__(self, master, path, toolitems):
         logging.basicConfig(filename='event_log.log', level=logging.INFO)
-        FIGSIZE = (8, 3)
-        self.window_id = next(self.id_generator)
+        FIGSIZE = plotting.FIGSIZE
         self.master = master
         self.toolitems = toolitems
 
@@ -28,30 +49,32 @@ class TkBase:
         master.title("BrainWave Visualization")
         master.state('zoomed')
         master.protocol("WM_DELETE_WINDOW", self.root_close)
+        # ctrl+shift+t switches recording timings to TRACE_FILE on and off
+        master.bind('<Control-T>', self.toggle_trace)
 
         self.initialize_annotation_display()
 
         self.initialize_graph_display(FIGSIZE)
 
+        # pending after() id and (start, stop, span) of the readings held by the main line
+        self.pending_render = None
+        self.rendered_range = None
+
+        self.initialize_progress_display()
+
         self.project_path = path
         self.json_path = self.project_path + "annotations.json"
-        try:
-            self.data, self.timestamps, self.annotations = data.open_project(
-                path)
-            if self.annotations != []:
-                if self.annotations[0] == -1:
-                    messagebox.showerror("Error: ", self.annotations[1])
-                    self.annotations = []
-            self.draw_graph(self.data, self.timestamps, self.annotations)
-            for id in self.annotations:
-                id = id.id
-                self.index_to_ids.append(id)
-            for a in self.annotations:
-                self.listb.insert(tkinter.END, a.title)
-        except Exception as e:
-            logging.error('Error during opening initial project')
-            logging.error(e)
-            messagebox.showerror("Error:", e)
+        self.journal = AnnotationJournal(self.json_path)
+        # writes annotation changes of the current project in the background
+        self.writer = None
+        self.pending_writes = self.master.after(self.WRITE_POLL, self.poll_writes)
+        self.data = None
+        self.timestamps = None
+        self.annotations = AnnotationStore()
+        # progress, result queue and pending after() id of the project currently loading in the background, if any
+        self.loading = None
+        self.loading_result = None
+        self.pending_load = None
 
         # put the plot with navbar on the tkinter window
         self.main_canvas.mpl_connect('button_release_event', self.butrelease)
@@ -73,6 +96,8 @@ class TkBase:
         self.span_min = None
         self.span_max = None
 
+        self.load_project(path)
+
     def initialize_annotation_display(self):
         """
         initializes the functionalities of the annotation display like the list and the buttons to browse annotations
@@ -87,9 +112,6 @@ class TkBase:
         self.listbox_frame = tkinter.Frame(self.annotation_frame, bg="#949494")
         self.listbox_frame.pack()
 
-        # list to convert from indices in listbox to annotation ids
-        self.index_to_ids = list()
-
         self.scrollbar = Scrollbar(self.listbox_frame, orient=tkinter.VERTICAL)
         self.listb = tkinter.Listbox(self.listbox_frame, width=30, height=int(
             0.1 * self.master.winfo_reqheight()), yscrollcommand=self.scrollbar.set)
@@ -120,6 +142,25 @@ class TkBase:
             self.annotation_frame, text='Delete', width=30, command=self.delete_callback)
         self.delete_annotation.pack(side="top")
 
+        # follow mode polls the project for readings still being written
+        self.follow_var = tkinter.BooleanVar(master=self.master, value=False)
+        self.pending_follow = None
+        self.follow_button = ttk.Checkbutton(
+            self.annotation_frame, text='Follow live recording', variable=self.follow_var, command=self.toggle_follow)
+        self.follow_button.pack(side="top")
+
+        # band power graph, off until asked for since it is computed over the whole recording
+        self.spectrum_var = tkinter.BooleanVar(master=self.master, value=False)
+        self.spectrum_button = ttk.Checkbutton(
+            self.annotation_frame, text='Show band power', variable=self.spectrum_var, command=self.toggle_spectrum)
+        self.spectrum_button.pack(side="top")
+        self.spectrum_window = ttk.Combobox(
+            self.annotation_frame, state='readonly', width=27,
+            values=['{:.2f} s windows'.format(window * 0.02) for window in self.SPECTRUM_WINDOWS])
+        self.spectrum_window.current(self.SPECTRUM_WINDOWS.index(spectral.WINDOW))
+        self.spectrum_window.bind('<<ComboboxSelected>>', lambda event: self.start_spectrum())
+        self.spectrum_window.pack(side="top")
+
     def initialize_graph_display(self, FIGSIZE):
         """
         initializes the functionalities of the graph display including the main and reference graph
@@ -128,28 +169,69 @@ class TkBase:
         logging.info('Initializing graph display')
 
         # create matplotlib figures with single axes on which the data will be
-        # displayed
-        self.main_graph, self.main_graph_ax = plt.subplots(figsize=FIGSIZE)
-        self.main_graph.set_facecolor('xkcd:grey')
-        self.main_graph_ax.set_facecolor('xkcd:dark grey')
+        # displayed, owned by this window rather than pyplot so they are freed with it
+        self.main_graph = Figure(figsize=FIGSIZE)
+        self.main_graph_ax = self.main_graph.add_subplot()
+        plotting.style_figure(self.main_graph, self.main_graph_ax)
 
         # second, reference graph
-        self.reference_graph, self.reference_graph_ax = plt.subplots(
-            figsize=FIGSIZE)
-        self.reference_graph.set_facecolor('xkcd:grey')
-        self.reference_graph_ax.set_facecolor('xkcd:dark grey')
-        self.main_canvas = FigureCanvasTkAgg(
+        self.reference_graph = Figure(figsize=FIGSIZE)
+        self.reference_graph_ax = self.reference_graph.add_subplot()
+        plotting.style_figure(self.reference_graph, self.reference_graph_ax)
+        self.main_canvas = InstrumentedCanvas(
             self.main_graph, master=self.master)
         self.main_canvas.get_tk_widget().pack(
             side=tkinter.BOTTOM, fill=tkinter.BOTH, expand=1)
         self.toolbar = NavigationToolbar(
             self.main_canvas, self.master, tkbase_=self, toolitems=self.toolitems)
 
-        self.reference_canvas = FigureCanvasTkAgg(
+        self.reference_canvas = InstrumentedCanvas(
             self.reference_graph, master=self.master)
         self.reference_canvas.get_tk_widget().pack(
             side=tkinter.BOTTOM, fill=tkinter.BOTH, expand=1)
 
+        # band power graph, packed above the main graph when shown
+        self.spectrum_graph = Figure(figsize=FIGSIZE)
+        self.spectrum_graph_ax = self.spectrum_graph.add_subplot()
+        plotting.style_figure(self.spectrum_graph, self.spectrum_graph_ax)
+        self.spectrum_canvas = InstrumentedCanvas(
+            self.spectrum_graph, master=self.master)
+        self.spectrum_lines = []
+        # BandPower shown, pending after() id and progress of its computation in the background
+        self.spectrum = None
+        self.pending_spectrum = None
+        self.spectrum_progress = None
+
+        # annotations are drawn over the main graph after every full draw
+        self.span_collection = None
+        self.point_collection = None
+        self.annotation_background = None
+        self.main_canvas.mpl_connect('draw_event', self.blit_annotations)
+
+        # the reference graph is kept as a bitmap, with the main graph's x-range blitted over it
+        self.viewport_rect = None
+        self.reference_background = None
+        self.reference_dragging = False
+        self.reference_canvas.mpl_connect('draw_event', self.blit_viewport)
+        self.reference_canvas.mpl_connect('button_press_event', self.reference_press)
+        self.reference_canvas.mpl_connect('motion_notify_event', self.reference_jump)
+        self.reference_canvas.mpl_connect('button_release_event', self.reference_release)
+
+    def initialize_progress_display(self):
+        """
+        initializes the progress bar, label and cancel button shown while a project loads in the background
+        """
+        self.progress_frame = tkinter.Frame(self.master, bg="#949494")
+        self.progress_bar = ttk.Progressbar(
+            self.progress_frame, orient=tkinter.HORIZONTAL, length=300, mode='determinate', maximum=1)
+        self.progress_bar.pack(side=tkinter.LEFT, padx=(10, 10))
+        self.progress_label = tkinter.Label(
+            self.progress_frame, text="", bg="#949494", anchor='w')
+        self.progress_label.pack(side=tkinter.LEFT)
+        self.progress_cancel = ttk.Button(
+            self.progress_frame, text='Cancel', command=self.cancel_load)
+        self.progress_cancel.pack(side=tkinter.LEFT, padx=(10, 10))
+
     def open(self):
         """
          callback method for the open button, opens an existing project
@@ -157,38 +239,128 @@ class TkBase:
         logging.info('Opening file...')
         path = filedialog.askdirectory()
         logging.info('Path given: {}'.format(path))
-        self.project_path = path + "/"
-        self.json_path = self.project_path + "annotations.json"
         try:
             logging.info('Checking validity of path')
             if data.check_valid_path(path):
-                self.data, self.timestamps, self.annotations = data.open_project(
-                    self.project_path)
-                if self.annotations != []:
-                    if self.annotations[0] == -1:
-                        messagebox.showerror("Error: ", self.annotations[1])
-                        self.annotations = []
-                self.draw_graph(self.data, self.timestamps, self.annotations)
-                self.index_to_ids = list()
-                self.id_to_shape = dict()
-                for id in self.annotations:
-                    id = id.id
-                    self.index_to_ids.append(id)
-                self.listb.delete(0, tkinter.END)
-                for a in self.annotations:
-                    self.listb.insert(tkinter.END, a.title)
-                self.span = SpanSelector(self.main_graph_ax, self.onselect, 'horizontal', useblit=True,
-                                         rectprops=dict(alpha=0.5, facecolor='red'), span_stays=True)
-                self.span.set_visible(False)
-                self.span_min = None
-                self.span_max = None
+                self.load_project(path + "/")
             else:
                 logging.warning('Invalid path given.')
-            logging.info('File open successfully')
         except Exception as e:
             logging.error(e)
             messagebox.showerror("Error:", e)
 
+    def load_project(self, path):
+        """
+        loads the project at path on a worker thread and polls for it with after(),
+        the current project and its annotations stay usable until the new one is ready
+        """
+        logging.info('Loading project at {} in the background'.format(path))
+        self.cancel_load()
+        progress = data.LoadProgress()
+        result = queue.Queue()
+
+        def work():
+            try:
+                loaded = data.recordings.open(path, self, progress=progress)
+            except Exception as e:
+                result.put(e)
+                return
+            # checked under the lock cancel_load takes, so exactly one of them gives back the recording
+            # of a load cancelled once it was done
+            with progress.lock:
+                result.put(loaded)
+                cancelled = progress.cancelled.is_set()
+            if cancelled:
+                data.recordings.release(self, loaded[0])
+
+        self.loading = progress
+        self.loading_result = result
+        self.progress_bar['value'] = 0
+        self.progress_label['text'] = "Loading {}".format(path)
+        self.progress_frame.pack(side=tkinter.TOP, fill=tkinter.X)
+        threading.Thread(target=work, daemon=True).start()
+        self.pending_load = self.master.after(self.LOAD_POLL, self.poll_load, path, progress, result)
+
+    def poll_load(self, path, progress, result):
+        """
+        updates the progress display until the worker of load_project is done, then shows the project
+        """
+        self.pending_load = None
+        if result.empty():
+            if progress.total_bytes:
+                self.progress_bar['value'] = progress.bytes_read / progress.total_bytes
+            self.progress_label['text'] = "Loading: {}/{} segments, {:.1f} MB read".format(
+                progress.segments, progress.total_segments, progress.bytes_read / 1e6)
+            self.pending_load = self.master.after(self.LOAD_POLL, self.poll_load, path, progress, result)
+            return
+        self.loading = self.loading_result = None
+        self.progress_frame.pack_forget()
+        loaded = result.get()
+        if isinstance(loaded, data.LoadCancelled):
+            logging.info('Loading of {} was cancelled'.format(path))
+        elif isinstance(loaded, Exception):
+            logging.error('Error during opening project')
+            logging.error(loaded)
+            messagebox.showerror("Error:", loaded)
+        elif self.project_loaded(path, *loaded):
+            logging.info('File open successfully')
+
+    def cancel_load(self):
+        """
+        cancels the project loading in the background and the polling for it, if any
+        """
+        if self.pending_load is not None:
+            self.master.after_cancel(self.pending_load)
+            self.pending_load = None
+        if self.loading is not None:
+            with self.loading.lock:
+                self.loading.cancel()
+                loaded = None if self.loading_result.empty() else self.loading_result.get()
+            # a load done but not polled for yet is not shown, its recording is given back
+            if loaded is not None and not isinstance(loaded, Exception):
+                data.recordings.release(self, loaded[0])
+            self.loading = self.loading_result = None
+            self.progress_frame.pack_forget()
+
+    def project_loaded(self, path, recording, timestamps, annotations):
+        """
+        replaces the current project with a loaded one and draws it, returns whether it did. The current
+        project is kept, and the loaded recording given back, when its unsaved annotation changes are not to be lost
+        """
+        if self.writer is not None:
+            if not self.unsaved_close([self.writer]):
+                data.recordings.release(self, recording)
+                return False
+            self.writer.close(self.WRITE_TIMEOUT)
+        self.project_path = path
+        self.json_path = self.project_path + "annotations.json"
+        self.journal = AnnotationJournal(self.json_path, data.annotation_converter(timestamps))
+        self.writer = AnnotationWriter(self.journal)
+        if self.data is not None:
+            data.recordings.release(self, self.data)
+        self.data, self.timestamps = recording, timestamps
+        if annotations != []:
+            if annotations[0] == -1:
+                messagebox.showerror("Error: ", annotations[1])
+                annotations = []
+        self.annotations = AnnotationStore(annotations)
+        self.id_to_shape = dict()
+        self.draw_graph(self.data, self.timestamps, self.annotations)
+        self.listb.delete(0, tkinter.END)
+        for a in self.annotations:
+            self.listb.insert(tkinter.END, a.title)
+        # the previous selector stays connected to the canvas, holding on to it, unless disconnected
+        self.span.disconnect_events()
+        self.span = SpanSelector(self.main_graph_ax, self.onselect, 'horizontal', useblit=True,
+                                 rectprops=dict(alpha=0.5, facecolor='red'), span_stays=True)
+        self.span.set_visible(False)
+        self.span_min = None
+        self.span_max = None
+        # the band power of the previous recording is not kept alive by the graph
+        self.spectrum = None
+        self.start_spectrum()
+        return True
+
     def open_concurrent(self):
         """
         callback method for the open concurrent button, opens a new window with a new project identical in functionality to the original application
@@ -263,11 +435,9 @@ class TkBase:
             else:
                 filename = self.project_path + export_popup_entry.get() + '.pdf'
                 logging.info('Saving figure at {}'.format(filename))
-                with PdfPages(filename) as export_pdf:
-                    plt.figure(self.window_id * 2 - 1)
-                    export_pdf.savefig()
-                    plt.figure(self.window_id * 2)
-                    export_pdf.savefig()
+                with PdfPages(filename) as export_pdf, self.static_annotations():
+                    export_pdf.savefig(self.main_graph)
+                    export_pdf.savefig(self.reference_graph)
                 logging.info('Export finished')
                 cancel()
 
@@ -291,46 +461,39 @@ class TkBase:
         callback function for the listbox widget
         """
         if(self.listb.curselection()):
-            id = self.index_to_ids[self.listb.curselection()[0]]
-
-            for a in self.annotations:
-                if a.id == id:
+            a = self.annotations.at(self.listb.curselection()[0])
 
-                    self.labelTitle['text'] = "Title: " + a.title
-                    self.labelDescription[
-                        'text'] = "Description: \n" + a.content
+            self.labelTitle['text'] = "Title: " + a.title
+            self.labelDescription[
+                'text'] = "Description: \n" + a.content
 
     def goto_callback(self):
         """
         callback for go to annotation button
         """
         if(self.listb.curselection()):
-            id = self.index_to_ids[self.listb.curselection()[0]]
+            a = self.annotations.at(self.listb.curselection()[0])
 
-            for a in self.annotations:
-                if a.id == id:
+            if(a.end != a.start):
+                range = self.get_vertical_range(a)
+                diff = (range[0] - range[1]) / 2
+                delta = (a.end - a.start) / 15
+                self.main_graph_ax.axis(
+                    [a.start - delta, a.end + delta, range[1] - diff, range[0] + diff])
 
-                    if(a.end != a.start):
-                        range = self.get_vertical_range(a)
-                        diff = (range[0] - range[1]) / 2
-                        delta = (a.end - a.start) / 15
-                        self.main_graph_ax.axis(
-                            [a.start - delta, a.end + delta, range[1] - diff, range[0] + diff])
-
-                    else:
+            else:
 
-                        delta = datetime.timedelta(seconds=5)
+                delta = datetime.timedelta(seconds=5)
 
-                        range_indices = np.where(np.logical_and(
-                            self.timestamps > a.start - datetime.timedelta(milliseconds=19), self.timestamps < a.end + datetime.timedelta(milliseconds=19)))
-                        range_data = self.data[range_indices]
-                        ypoint = range_data[np.argmax(range_data)]
+                ypoint = self.data.extrema(*self.data.time_range(
+                    a.start - datetime.timedelta(milliseconds=19), a.end + datetime.timedelta(milliseconds=19)))[0]
 
-                        self.main_graph_ax.axis(
-                            [a.start - delta, a.end + delta, ypoint - 30, ypoint + 30])
+                self.main_graph_ax.axis(
+                    [a.start - delta, a.end + delta, ypoint - 30, ypoint + 30])
 
-                    self.main_graph.canvas.toolbar.push_current()
-                    self.main_graph.canvas.draw()
+            self.update_main_line()
+            self.main_graph.canvas.toolbar.push_current()
+            self.main_graph.canvas.draw()
 
     def edit_callback(self):
         """
@@ -350,60 +513,55 @@ class TkBase:
                         top, text="Please add a title!", fg="red")
                     error_label.grid(row=3)
                 else:
+                    self.writer.edit(annotation, title_entry.get(), description_entry.get(1.0, tkinter.END))
                     annotation.title = title_entry.get()
                     annotation.content = description_entry.get(
                         1.0, tkinter.END)
-                    save_json(self.annotations,
-                              self.json_path)
                     self.listb.delete(index)
                     self.listb.insert(index, title_entry.get())
                     cancel()
 
             index = self.listb.curselection()[0]
-            id = self.index_to_ids[self.listb.curselection()[0]]
-
-            annotation = None
-
-            for a in self.annotations:
-                if a.id == id:
-                    # popup in which you edit the annotation
-                    annotation = a
-                    top = Toplevel(self.master)
-                    top.title('edit annotation')
-                    top.grab_set()
-
-                    # labels in top level window showing annotation start time
-                    # and end time
-                    annotation_start_label = Label(
-                        top, text='Annotation start time: ' + str(a.start))
-                    annotation_end_label = Label(
-                        top, text='Annotation end time: ' + str(a.end))
-                    annotation_start_label.grid(row=0)
-                    annotation_end_label.grid(row=1)
-
-                    annotation_title_label = Label(top, text='Title')
-                    annotation_title_label.grid(row=2)
-                    title_entry = Entry(top, font=("Courier", 12))
-                    title_entry.insert(tkinter.END, a.title)
-                    title_entry.grid(row=4)
-
-                    description_label = Label(top, text='Description')
-                    description_label.grid(row=5)
-                    description_entry = tkinter.Text(top, height=6, width=30)
-                    description_entry.insert(tkinter.END, a.content)
-                    description_entry.grid(row=6)
-
-                    cancel_button = Button(
-                        master=top, text="Cancel", command=cancel, bg='white')
-                    cancel_button.grid(row=8)
-
-                    save_button = Button(
-                        master=top, text="Save", command=save, bg='white')
-                    save_button.grid(row=7)
-
-                    top.resizable(False, False)
-                    top.iconbitmap(r"./res/general_images/favicon.ico")
-                    top.protocol("WM_DELETE_WINDOW", cancel)
+            annotation = self.annotations.at(index)
+            a = annotation
+
+            # popup in which you edit the annotation
+            top = Toplevel(self.master)
+            top.title('edit annotation')
+            top.grab_set()
+
+            # labels in top level window showing annotation start time
+            # and end time
+            annotation_start_label = Label(
+                top, text='Annotation start time: ' + str(a.start))
+            annotation_end_label = Label(
+                top, text='Annotation end time: ' + str(a.end))
+            annotation_start_label.grid(row=0)
+            annotation_end_label.grid(row=1)
+
+            annotation_title_label = Label(top, text='Title')
+            annotation_title_label.grid(row=2)
+            title_entry = Entry(top, font=("Courier", 12))
+            title_entry.insert(tkinter.END, a.title)
+            title_entry.grid(row=4)
+
+            description_label = Label(top, text='Description')
+            description_label.grid(row=5)
+            description_entry = tkinter.Text(top, height=6, width=30)
+            description_entry.insert(tkinter.END, a.content)
+            description_entry.grid(row=6)
+
+            cancel_button = Button(
+                master=top, text="Cancel", command=cancel, bg='white')
+            cancel_button.grid(row=8)
+
+            save_button = Button(
+                master=top, text="Save", command=save, bg='white')
+            save_button.grid(row=7)
+
+            top.resizable(False, False)
+            top.iconbitmap(r"./res/general_images/favicon.ico")
+            top.protocol("WM_DELETE_WINDOW", cancel)
 
     def delete_callback(self):
         """
@@ -411,18 +569,11 @@ class TkBase:
         """
         if(self.listb.curselection()):
             index = self.listb.curselection()[0]
-            id = self.index_to_ids[self.listb.curselection()[0]]
-
-            for a in self.annotations:
-                if a.id == id:
-                    self.index_to_ids.remove(id)
-                    self.annotations.remove(a)
-                    self.id_to_shape[id].remove()
-                    del self.id_to_shape[id]
-                    self.main_graph.canvas.draw()
-                    save_json(self.annotations,
-                              self.json_path)
-                    self.listb.delete(index)
+            a = self.annotations.remove(index)
+            self.id_to_shape.pop(a.id, None)
+            self.refresh_annotations()
+            self.writer.delete(a)
+            self.listb.delete(index)
 
     def pick_color(self):
         color = colorchooser.askcolor()
@@ -472,13 +623,14 @@ class TkBase:
                 else:
                     nonlocal annotation_color
                     if annotation_color is None:
-                        annotation_color = (256, 0, 0)
+                        annotation_color = Annotation.DEFAULT_COLOR
                     new_annotation = Annotation(title_entry.get(), description_entry.get(1.0, tkinter.END),
                                                 self.span_min, self.span_max, annotation_color)
-                    self.annotations.append(new_annotation)
-                    save_json(self.annotations, self.json_path)
+                    # drawn first, so an annotation that cannot be drawn is never saved
                     self.draw_annotation(new_annotation)
-                    self.index_to_ids.append(new_annotation.id)
+                    self.annotations.add(new_annotation)
+                    self.writer.add(new_annotation)
+                    self.refresh_annotations()
                     self.listb.insert(tkinter.END, new_annotation.title)
 
                     # set spans back to none after the annotation is saved to
@@ -541,87 +693,464 @@ class TkBase:
     def onselect(self, min, max):
         """
         callback method of the span selector, after every selection it writes
-        the selected range to class variables
+        the selected range to class variables, snapped to the readings nearest to its ends
         """
-        self.span_min = datetime.datetime.fromordinal(
-            int(min)) + datetime.timedelta(seconds=divmod(min, 1)[1] * 86400)
-        self.span_max = datetime.datetime.fromordinal(
-            int(max)) + datetime.timedelta(seconds=divmod(max, 1)[1] * 86400)
+        self.span_min = self.timestamps.time_of_num(min)
+        self.span_max = self.timestamps.time_of_num(max)
 
     def get_vertical_range(self, annotation):
         """
         get vertical range for a given annotation
         """
 
-        range_indices = np.where(np.logical_and(
-            self.timestamps > annotation.start, self.timestamps < annotation.end))
-
-        range_data = self.data[range_indices]
-        return range_data[np.argmax(
-            range_data)], range_data[np.argmin(range_data)]
+        return self.data.extrema(*self.data.span_range(annotation.start, annotation.end))
 
     def draw_annotation(self, annotation):
         """
-        draws annotation to the main graph as a box if it's a span or a line if it's a point annotation
+        adds an annotation to the main graph as a box if it's a span or a line if it's a point annotation,
+        shown after the next update_annotation_collections if it is in view
         """
+        self.id_to_shape[annotation.id] = plotting.annotation_shape(annotation, self.data)
 
-        # if date range annotation draw rectangle
-        annotation_color = annotation.color
-        annotation_color = tuple(map(lambda x: x / 256, annotation_color))
-        annotation_color = annotation_color + (0.5,)
-        if(annotation.start != annotation.end):
-            vmax, vmin = self.get_vertical_range(annotation)
-            self.id_to_shape[annotation.id] = self.main_graph_ax.add_patch(plt.Rectangle((date2num(annotation.start), vmin - 10),
-                                                                                         date2num(annotation.end) - date2num(annotation.start), vmax - vmin + 20, color=annotation_color))
-        # if point annotation draw a vertical line
-        if(annotation.start == annotation.end):
-            plt.figure(self.window_id * 2 - 1)
-            self.id_to_shape[annotation.id] = plt.axvline(
-                x=date2num(annotation.start), color=annotation_color)
-        self.main_graph.canvas.draw()
+    def update_annotation_collections(self):
+        """
+        puts the shapes of the annotations overlapping the rendered range of the main line into one collection
+        for spans and one for point lines, found through the interval index of the annotations. Shapes are only
+        kept for the annotations shown, so a project with many annotations only builds the ones in view.
+        """
+        if self.rendered_range is None:
+            return
+        start, stop, span = self.rendered_range
+        shown = self.annotations.overlapping(self.timestamps.time_of(start), self.timestamps.time_of(stop))
+        shapes = dict()
+        for annotation in shown:
+            if annotation.id not in self.id_to_shape:
+                self.draw_annotation(annotation)
+            shapes[annotation.id] = self.id_to_shape[annotation.id]
+        self.id_to_shape = shapes
+        plotting.set_annotation_shapes(
+            self.span_collection, self.point_collection, list(shapes.values()))
+
+    def blit_annotations(self, event=None):
+        """
+        callback for every full draw of the main graph, saves the graph without the animated annotation
+        collections as background and draws the collections over it
+        """
+        if self.span_collection is None:
+            return
+        self.annotation_background = self.main_canvas.copy_from_bbox(
+            self.main_graph_ax.bbox)
+        self.main_graph_ax.draw_artist(self.span_collection)
+        self.main_graph_ax.draw_artist(self.point_collection)
+
+    def refresh_annotations(self):
+        """
+        shows added or deleted annotations by blitting the collections over the saved background
+        instead of redrawing the whole figure
+        """
+        self.update_annotation_collections()
+        if self.annotation_background is None:
+            self.main_canvas.draw_idle()
+            return
+        self.main_canvas.restore_region(self.annotation_background)
+        self.main_graph_ax.draw_artist(self.span_collection)
+        self.main_graph_ax.draw_artist(self.point_collection)
+        self.main_canvas.blit(self.main_graph_ax.bbox)
+
+    @contextlib.contextmanager
+    def static_annotations(self):
+        """
+        draws the annotation collections as normal artists while figures are saved, as animated artists are left out
+        """
+        collections = [c for c in (self.span_collection, self.point_collection) if c is not None]
+        for collection in collections:
+            collection.set_animated(False)
+        try:
+            yield
+        finally:
+            for collection in collections:
+                collection.set_animated(True)
 
     def draw_graph(self, data, timestamps, annotations):
         """
         draws the main graph and the referece graph given data, timestamps and annotations
         """
-        logging.info('Drawing main graph')
-        self.main_graph_ax.clear()
-        # plot values on the axe and set plot hue to NHS blue
-        self.main_graph_ax.plot(timestamps, data, color='#5436ff')
-        # draw all saved annotations
-        logging.info('Drawing annotations')
-        for annotation in annotations:
-            self.draw_annotation(annotation)
-
-        self.main_graph_ax.xaxis_date()
-        plt.gcf().autofmt_xdate()
-        # adding grid
-        self.main_graph_ax.grid(
-            color='grey', linestyle='-', linewidth=0.25, alpha=0.5)
-        # removing top and right borders
-        self.main_graph_ax.spines['top'].set_visible(False)
-        self.main_graph_ax.spines['right'].set_visible(False)
-        # put the plot with navbar on the tkinter window
-        self.main_canvas.draw()
-        self.toolbar.update()
-        self.main_graph.canvas.toolbar.push_current()
-
-        # second, reference graph displayed
-        logging.info('Drawing reference graph')
-        self.reference_graph_ax.clear()
-        self.reference_graph_ax.plot(
-            self.timestamps, self.data, color="cyan", linewidth=1)
-        self.reference_graph_ax.xaxis_date()
-        # put the second plot on the tkinter window
-        self.reference_canvas.draw()
+        with instrument.span('draw_graph', readings=len(data), annotations=len(annotations)):
+            logging.info('Drawing main graph')
+            # the min/max envelope is built once per recording so only a few points per pixel are drawn
+            self.pyramid = data.pyramid
+            # annotations are drawn as two collections, animated so they can be blitted on their own
+            self.main_line, self.span_collection, self.point_collection = plotting.draw_main(
+                self.main_graph_ax, data, animated=True)
+            self.rendered_range = (0, len(data), len(data))
+            # re-render the main line whenever pan, zoom or the toolbar history move the view
+            self.main_graph_ax.callbacks.connect(
+                'xlim_changed', self.main_xlim_changed)
+            logging.info('Drawing annotations')
+            self.annotation_background = None
+            self.id_to_shape = dict()
+            self.update_annotation_collections()
+
+            self.main_graph.autofmt_xdate()
+            # put the plot with navbar on the tkinter window
+            self.main_canvas.draw()
+            self.toolbar.update()
+            self.main_graph.canvas.toolbar.push_current()
+
+            # second, reference graph displayed
+            logging.info('Drawing reference graph')
+            self.reference_line = plotting.draw_reference(self.reference_graph_ax, data)
+            # the main graph's x-range, animated so it is left out of the cached bitmap
+            self.viewport_rect = Rectangle((0, 0), 0, 1, transform=self.reference_graph_ax.get_xaxis_transform(),
+                                           facecolor='white', edgecolor='white', alpha=0.3, animated=True)
+            self.reference_graph_ax.add_artist(self.viewport_rect)
+            self.reference_background = None
+            self.update_viewport_rect()
+            # put the second plot on the tkinter window
+            self.reference_canvas.draw()
+
+    def envelope(self, start, stop, ax):
+        """
+        returns the date numbers and values needed to draw the readings in [start, stop) at the pixel width of ax
+        """
+        return plotting.envelope(self.data, start, stop, ax)
+
+    def visible_range(self):
+        """
+        returns the fractional reading indices (start, stop) of the current x-range of the main graph
+        """
+        return self.timestamps.indices_of_nums(self.main_graph_ax.get_xlim())
+
+    def needs_render(self):
+        """
+        checks whether the main line no longer covers the visible range or was rendered for a different zoom
+        """
+        if self.rendered_range is None:
+            return False
+        start, stop = self.visible_range()
+        rendered_start, rendered_stop, rendered_span = self.rendered_range
+        span = stop - start
+        covered = start >= rendered_start and stop <= rendered_stop
+        return not covered or not rendered_span / 2 <= span <= rendered_span * 2
+
+    def main_xlim_changed(self, ax):
+        """
+        callback for x-range changes of the main graph, moves the viewport rectangle on the reference graph
+        and debounces re-rendering until the view settles
+        """
+        self.blit_viewport_rect()
+        self.follow_spectrum()
+        if not self.needs_render():
+            return
+        if self.pending_render is not None:
+            self.master.after_cancel(self.pending_render)
+        self.pending_render = self.master.after(
+            self.RENDER_DELAY, self.render_viewport)
+
+    def render_viewport(self):
+        """
+        re-renders the main line for the settled view and redraws the canvas
+        """
+        self.pending_render = None
+        if self.needs_render():
+            with instrument.span('render_viewport'):
+                self.update_main_line()
+            self.main_canvas.draw_idle()
+
+    def update_main_line(self):
+        """
+        re-renders the main line at the resolution of the current x-range of the main graph,
+        holding the readings of the visible range plus a margin on either side
+        """
+        start, stop = self.visible_range()
+        span = stop - start
+        margin = span * self.RENDER_MARGIN
+        indices, values = self.pyramid.envelope(
+            start - margin, stop + margin + 1,
+            self.main_graph_ax.get_window_extent().width * (1 + 2 * self.RENDER_MARGIN))
+        self.main_line.set_data(self.timestamps.nums(indices), values)
+        self.rendered_range = (start - margin, stop + margin, span)
+        self.update_annotation_collections()
+
+    def update_viewport_rect(self):
+        """
+        moves the viewport rectangle to the current x-range of the main graph
+        """
+        start, end = self.main_graph_ax.get_xlim()
+        self.viewport_rect.set_x(start)
+        self.viewport_rect.set_width(end - start)
+
+    def blit_viewport(self, event=None):
+        """
+        callback for every full draw of the reference graph, which only happens for a new recording or window size,
+        saves the graph as background and draws the viewport rectangle over it
+        """
+        if self.viewport_rect is None:
+            return
+        self.reference_background = self.reference_canvas.copy_from_bbox(
+            self.reference_graph.bbox)
+        self.reference_graph_ax.draw_artist(self.viewport_rect)
+
+    def blit_viewport_rect(self):
+        """
+        shows the current x-range of the main graph on the reference graph by blitting the rectangle over the
+        cached background instead of redrawing the reference graph
+        """
+        if self.viewport_rect is None:
+            return
+        self.update_viewport_rect()
+        if self.reference_background is None:
+            return
+        self.reference_canvas.restore_region(self.reference_background)
+        self.reference_graph_ax.draw_artist(self.viewport_rect)
+        self.reference_canvas.blit(self.reference_graph.bbox)
+
+    def reference_press(self, event):
+        """
+        callback for clicks on the reference graph, starts dragging the main graph's view along
+        """
+        if event.inaxes is not self.reference_graph_ax or event.button != MouseButton.LEFT or self.data is None:
+            return
+        self.reference_dragging = True
+        self.reference_jump(event)
+
+    def reference_jump(self, event):
+        """
+        centres the main graph on the pointer keeping its width, for clicks and drags on the reference graph
+        """
+        if not self.reference_dragging or event.inaxes is not self.reference_graph_ax:
+            return
+        start, end = self.main_graph_ax.get_xlim()
+        half = (end - start) / 2
+        self.main_graph_ax.set_xlim(event.xdata - half, event.xdata + half)
+        self.main_canvas.draw_idle()
+
+    def reference_release(self, event):
+        """
+        callback for releasing the mouse on the reference graph, adds the view jumped to to the toolbar history
+        """
+        if not self.reference_dragging:
+            return
+        self.reference_dragging = False
+        self.toolbar.push_current()
+
+    def toggle_follow(self):
+        """
+        callback for the follow checkbox, starts or stops polling the project for new readings
+        """
+        if self.pending_follow is not None:
+            self.master.after_cancel(self.pending_follow)
+            self.pending_follow = None
+        if self.follow_var.get():
+            logging.info('Following live recording')
+            self.follow_poll()
+
+    def follow_poll(self):
+        """
+        maps readings appended since the last poll and scrolls both graphs to them, the cost
+        depends only on the new readings
+        """
+        self.pending_follow = None
+        if not self.follow_var.get():
+            return
+        if self.data is not None and self.loading is None:
+            changed = self.data.refresh()
+            if changed is not None:
+                self.follow_view(changed)
+        self.pending_follow = self.master.after(self.FOLLOW_POLL, self.follow_poll)
+
+    def follow_view(self, changed):
+        """
+        keeps the width of the main view but moves it to end at the last reading, and extends the reference graph
+        and the band power from changed, the first reading refresh replaced
+        """
+        end = len(self.data)
+        start, stop = self.visible_range()
+        span = stop - start
+        self.reference_line.set_data(
+            *self.envelope(0, end, self.reference_graph_ax))
+        self.reference_graph_ax.set_xlim(self.timestamps.nums([0, end - 1]))
+        self.reference_canvas.draw_idle()
+        # rendered_range is cleared so the moved view is always re-rendered with the new readings
+        self.rendered_range = None
+        self.main_graph_ax.set_xlim(self.timestamps.nums([end - span, end]))
+        self.update_main_line()
+        self.main_canvas.draw_idle()
+        self.start_spectrum(changed)
+
+    def toggle_spectrum(self):
+        """
+        callback for the band power checkbox, shows the graph above the main graph and computes it, or hides it
+        """
+        if self.spectrum_var.get():
+            self.spectrum_canvas.get_tk_widget().pack(
+                side=tkinter.BOTTOM, fill=tkinter.BOTH, expand=1, after=self.toolbar)
+            self.start_spectrum()
+        else:
+            self.cancel_spectrum()
+            self.spectrum_canvas.get_tk_widget().pack_forget()
+
+    def start_spectrum(self, changed=None):
+        """
+        computes the band power of the recording for the selected window on a worker thread, in chunks so memory
+        stays fixed, and polls for it with after(), drawing the windows done so far. Settings computed before
+        are kept on the recording, so switching back to them or growing the recording only computes what is missing,
+        from the windows over changed when readings were replaced.
+        """
+        if not self.spectrum_var.get() or self.data is None:
+            return
+        self.cancel_spectrum()
+        window = self.SPECTRUM_WINDOWS[self.spectrum_window.current()]
+        power = spectral.band_power(self.data, window, window // 2)
+        if power is not self.spectrum:
+            self.spectrum = power
+            self.spectrum_lines = plotting.draw_band_power(self.spectrum_graph_ax, power.bands)
+        progress = data.LoadProgress()
+        result = queue.Queue()
+
+        def work():
+            try:
+                power.compute(progress, changed)
+                result.put(None)
+            except Exception as e:
+                result.put(e)
+
+        self.spectrum_progress = progress
+        threading.Thread(target=work, daemon=True).start()
+        self.poll_spectrum(power, progress, result)
+
+    def poll_spectrum(self, power, progress, result):
+        """
+        redraws the band power graph with the windows computed so far until the worker of start_spectrum is done
+        """
+        self.pending_spectrum = None
+        if progress.cancelled.is_set():
+            return
+        finished = not result.empty()
+        self.draw_spectrum()
+        if not finished:
+            self.pending_spectrum = self.master.after(self.SPECTRUM_POLL, self.poll_spectrum, power, progress, result)
+            return
+        self.spectrum_progress = None
+        error = result.get()
+        if error is not None:
+            logging.error('Band power could not be computed')
+            logging.error(error)
+            messagebox.showerror("Error:", error)
+
+    def draw_spectrum(self):
+        """
+        puts the computed band powers on the band power graph, over the x-range of the main graph
+        """
+        done = self.spectrum.done
+        nums = self.timestamps.nums(self.spectrum.centres(0, done))
+        for band, line in enumerate(self.spectrum_lines):
+            line.set_data(nums, self.spectrum.power[:done, band])
+        if done:
+            self.spectrum_graph_ax.relim()
+            self.spectrum_graph_ax.autoscale_view(scalex=False)
+        self.spectrum_graph_ax.set_xlim(self.main_graph_ax.get_xlim())
+        self.spectrum_canvas.draw_idle()
+
+    def follow_spectrum(self):
+        """
+        gives the band power graph the x-range of the main graph, when it is shown
+        """
+        if self.spectrum is None or not self.spectrum_var.get():
+            return
+        self.spectrum_graph_ax.set_xlim(self.main_graph_ax.get_xlim())
+        self.spectrum_canvas.draw_idle()
+
+    def cancel_spectrum(self):
+        """
+        stops computing and polling the band power, the windows computed so far are kept
+        """
+        if self.spectrum_progress is not None:
+            self.spectrum_progress.cancel()
+            self.spectrum_progress = None
+        if self.pending_spectrum is not None:
+            self.master.after_cancel(self.pending_spectrum)
+            self.pending_spectrum = None
+
+    def poll_writes(self):
+        """
+        reports annotation changes the background writer failed to save, they are tried again with the next change
+        """
+        if self.writer is not None:
+            while not self.writer.errors.empty():
+                error = self.writer.errors.get()
+                messagebox.showerror(
+                    "Error:", "The annotations could not be saved: {}".format(error))
+        self.pending_writes = self.master.after(self.WRITE_POLL, self.poll_writes)
+
+    def unsaved_close(self, writers):
+        """
+        writes the pending annotation changes of writers before closing, returns whether to go on closing
+        """
+        if all([writer.flush(self.WRITE_TIMEOUT) for writer in writers]):
+            return True
+        return messagebox.askokcancel(
+            "Close", "Some annotation changes could not be saved and will be lost, close anyway?")
+
+    def toggle_trace(self, event=None):
+        """
+        starts or stops recording the timing and memory of loading and drawing to TRACE_FILE
+        """
+        if instrument.enabled():
+            instrument.stop()
+            messagebox.showinfo("Timings", "Timings written to {}".format(os.path.abspath(self.TRACE_FILE)))
+        else:
+            instrument.start(self.TRACE_FILE)
+
+    def release_figures(self):
+        """
+        stops the polls of the window and empties its figures, so nothing keeps a closed window or its line data alive
+        """
+        # after() callbacks belong to the interpreter and would outlive the window
+        self.cancel_load()
+        for pending in (self.pending_render, self.pending_follow, self.pending_writes):
+            if pending is not None:
+                self.master.after_cancel(pending)
+        self.pending_render = self.pending_follow = self.pending_writes = None
+        self.cancel_spectrum()
+        self.span.disconnect_events()
+        for figure in (self.main_graph, self.reference_graph, self.spectrum_graph):
+            figure.clear()
+        self.spectrum = None
+        self.spectrum_lines = []
+        self.main_line = self.reference_line = self.viewport_rect = None
+        self.span_collection = self.point_collection = None
+        self.annotation_background = self.reference_background = None
+        self.data = self.timestamps = self.pyramid = None
+        self.id_to_shape = dict()
 
     def root_close(self):
         if messagebox.askokcancel(
                 "Close app", "Closing this window will close all windows, are you sure?"):
-            self.master.quit()
+            if self.unsaved_close(list(AnnotationWriter.running)):
+                AnnotationWriter.close_all(self.WRITE_TIMEOUT)
+                data.recordings.clear()
+                self.release_figures()
+                self.master.quit()
 
     def child_close(self):
-        self.master.destroy()
+        if self.writer is None or self.unsaved_close([self.writer]):
+            if self.writer is not None:
+                self.writer.close(self.WRITE_TIMEOUT)
+            self.cancel_load()
+            data.recordings.release(self)
+            self.release_figures()
+            self.master.destroy()
+
+
+class InstrumentedCanvas(FigureCanvasTkAgg):
+    """
+    FigureCanvasTkAgg recording every full draw of its figure as a span
+    """
+
+    def draw(self):
+        with instrument.span('canvas_draw', figure=id(self.figure)):
+            super().draw()
 
 
 class NavigationToolbar(NavigationToolbar2Tk):
@@ -644,6 +1173,10 @@ class NavigationToolbar(NavigationToolbar2Tk):
         b.pack(side=tkinter.LEFT)
         return b
 
+    def save_figure(self, *args):
+        with self.tkbase_.static_annotations():
+            NavigationToolbar2Tk.save_figure(self, *args)
+
     def call_annotate(self):
         self.tkbase_.annotate()
 